@@ -0,0 +1,137 @@
+import asyncio
+import os
+import ssl
+import time
+import requests
+from akamai.edgegrid import EdgeGridAuth
+from .base import Akamai, RETRYABLE_STATUSES, get_retry_delay
+
+## aiohttp is only needed by the async client, so the synchronous client works without it
+try:
+    import aiohttp
+except ImportError:
+    aiohttp = None
+
+AIOHTTP_REQUIRED = "The async Akamai client requires aiohttp. Install it with: python -m pip install aiohttp"
+
+
+class AsyncAkamai(Akamai):
+    ## asyncio counterpart of Akamai. get, post and put return coroutines, and every request made from an event loop
+    ## shares one pooled aiohttp session. Use as an async context manager, or await close() when finished
+    def __init__(self, *args, **kwargs):
+        if aiohttp is None:
+            raise (Exception(AIOHTTP_REQUIRED))
+        super().__init__(*args, **kwargs)
+        self.session = None
+
+    @classmethod
+    def from_client(cls, client):
+        ## Create an async client sharing the credentials, settings and rate limiter of a synchronous one
+        if aiohttp is None:
+            raise (Exception(AIOHTTP_REQUIRED))
+        async_client = cls.__new__(cls)
+        async_client.__dict__.update(client.__dict__)
+        async_client.conditional_responses = {}
+        async_client.session = None
+        return async_client
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    def get_session(self):
+        ## Created on first use, as an aiohttp session belongs to the event loop it was created in
+        if self.session is None:
+            # Trust the same CA bundle as requests does for the synchronous client
+            ssl_context = True
+            ca_bundle = os.environ.get("REQUESTS_CA_BUNDLE") or os.environ.get("CURL_CA_BUNDLE")
+            if ca_bundle:
+                ssl_context = ssl.create_default_context(cafile=ca_bundle)
+            self.session = aiohttp.ClientSession(connector=aiohttp.TCPConnector(limit=self.pool_size, ssl=ssl_context))
+        return self.session
+
+    def get_client_timeout(self):
+        if isinstance(self.timeout, tuple):
+            return aiohttp.ClientTimeout(sock_connect=self.timeout[0], sock_read=self.timeout[1])
+        return aiohttp.ClientTimeout(total=self.timeout)
+
+    def sign(self, method, request_url, request_headers, body):
+        ## EdgeGrid signing works on requests' prepared requests, so sign one and send its headers and body with aiohttp
+        auth = EdgeGridAuth(
+            client_token=self.credentials["client_token"],
+            client_secret=self.credentials["client_secret"],
+            access_token=self.credentials["access_token"],
+        )
+        prepared = requests.Request(
+            method, request_url, headers=request_headers, data=body if method != "GET" else None
+        ).prepare()
+        auth(prepared)
+        signed_body = prepared.body.encode("utf-8") if isinstance(prepared.body, str) else prepared.body
+        return dict(prepared.headers), signed_body
+
+    async def do(self, method, path, query, headers, body=None, conditional=False, idempotent=None):
+        request_url, request_headers, body, previous_response = self.prepare(
+            method, path, query, headers, body, conditional
+        )
+
+        # POSTs may create something, so are only retried if the request can't have been processed
+        if idempotent is None:
+            idempotent = method != "POST"
+
+        session = self.get_session()
+
+        attempt = 0
+        while True:
+            wait = self.rate_limiter.try_acquire()
+            while wait > 0:
+                await asyncio.sleep(wait)
+                wait = self.rate_limiter.try_acquire()
+
+            # Signatures include a timestamp, so each attempt is signed again
+            signed_headers, signed_body = self.sign(method, request_url, request_headers, body)
+            start = time.perf_counter()
+            try:
+                async with session.request(
+                    method, request_url, headers=signed_headers, data=signed_body, timeout=self.get_client_timeout()
+                ) as response:
+                    content = await response.read()
+                    status = response.status
+                    response_headers = response.headers
+            except (aiohttp.ClientError, asyncio.TimeoutError) as err:
+                self.report_request(method, path, start)
+                retryable = not isinstance(err, aiohttp.ClientSSLError) and (
+                    isinstance(err, aiohttp.ClientConnectorError) or idempotent
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                delay = self.get_backoff(attempt)
+                self.log_retry(method, path, attempt, str(err) or type(err).__name__, delay)
+                await asyncio.sleep(delay)
+                attempt += 1
+                continue
+            self.report_request(method, path, start, status, len(content))
+
+            # If the last request allowed has been used, wait for the limit to reset before sending any more
+            if response_headers.get("x-ratelimit-remaining") == "0":
+                self.rate_limiter.pause(get_retry_delay(response_headers) or 0)
+
+            # Rate limited requests were not processed, so are always safe to retry
+            retryable = status == 429 or (idempotent and status in RETRYABLE_STATUSES)
+            if not retryable or attempt >= self.max_retries:
+                break
+            delay = self.get_backoff(attempt, get_retry_delay(response_headers))
+            if status == 429:
+                ## Hold back every request sharing these credentials until the limit resets
+                self.rate_limiter.pause(delay)
+            self.log_retry(method, path, attempt, str(status) + " response", delay)
+            await asyncio.sleep(delay)
+            attempt += 1
+
+        return self.parse_response(request_url, status, response_headers, content, conditional, previous_response)
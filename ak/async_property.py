@@ -0,0 +1,104 @@
+from .async_base import AsyncAkamai
+
+
+class AsyncProperty(AsyncAkamai):
+    ## asyncio counterpart of Property, with the same methods as coroutines
+    async def listGroups(self):
+        path = "/papi/v1/groups"
+        result = await self.get(path=path)
+        return result["groups"]["items"]
+
+    async def listHostnames(self, propertyId, version):
+        path = "/papi/v1/properties/{propertyId}/versions/{version}/hostnames".format(
+            propertyId=propertyId, version=version
+        )
+        result = await self.get(path=path)
+        return result["hostnames"]["items"]
+
+    async def setHostnames(self, propertyId, version, hostnames):
+        path = "/papi/v1/properties/{propertyId}/versions/{version}/hostnames".format(
+            propertyId=propertyId, version=version
+        )
+        result = await self.put(path=path, body=hostnames)
+        return result
+
+    async def listActivations(self, propertyId):
+        path = "/papi/v1/properties/{propertyId}/activations".format(propertyId=propertyId)
+        result = await self.get(path=path)
+        return result["activations"]["items"]
+
+    async def getActivation(self, propertyId, activationId):
+        path = "/papi/v1/properties/{propertyId}/activations/{activationId}".format(
+            propertyId=propertyId, activationId=activationId
+        )
+        result = await self.get(path=path, conditional=True)
+        return result["activations"]["items"][0]
+
+    async def getProperty(self, propertyId, contractId=None, groupId=None):
+        path = "/papi/v1/properties/{propertyId}".format(propertyId=propertyId)
+        query = None
+        if contractId is not None and groupId is not None:
+            query = "contractId={contractId}&groupId={groupId}".format(contractId=contractId, groupId=groupId)
+        result = await self.get(path=path, query=query)
+        return result["properties"]["items"][0]
+
+    async def getPropertyVersion(self, propertyId, propertyVersion, contractId=None, groupId=None):
+        path = "/papi/v1/properties/{propertyId}/versions/{propertyVersion}".format(
+            propertyId=propertyId, propertyVersion=propertyVersion
+        )
+        query = None
+        if contractId is not None and groupId is not None:
+            query = "contractId={contractId}&groupId={groupId}".format(contractId=contractId, groupId=groupId)
+        result = await self.get(path=path, query=query)
+        return result["versions"]["items"][0]
+
+    async def getPropertyRules(self, propertyId, propertyVersion, ruleFormat=None):
+        path = "/papi/v1/properties/{propertyId}/versions/{propertyVersion}/rules".format(
+            propertyId=propertyId, propertyVersion=propertyVersion
+        )
+        headers = {}
+        if ruleFormat is not None:
+            headers["Accept"] = "application/vnd.akamai.papirules.{ruleFormat}+json".format(ruleFormat=ruleFormat)
+        result = await self.get(path=path, headers=headers)
+        return result
+
+    async def bulkSearch(self, body):
+        path = "/papi/v1/bulk/rules-search-requests-synch"
+        result = await self.post(path=path, body=body, idempotent=True)
+        return result["results"]
+
+    async def findProperty(self, propertyName):
+        path = "/papi/v1/search/find-by-value"
+        body = {"propertyName": propertyName}
+        result = await self.post(path=path, body=body, idempotent=True)
+        return result["versions"]["items"]
+
+    async def newPropertyVersion(self, propertyId, createFromVersion):
+        path = "/papi/v1/properties/{propertyId}/versions".format(propertyId=propertyId)
+        body = {"createFromVersion": createFromVersion}
+        result = await self.post(path=path, body=body)
+        return result["versionLink"]
+
+    async def updateVersion(self, propertyId, propertyVersion, rules, ruleFormat):
+        path = "/papi/v1/properties/{propertyId}/versions/{propertyVersion}/rules".format(
+            propertyId=propertyId, propertyVersion=propertyVersion
+        )
+        headers = {}
+        if ruleFormat is not None:
+            headers["Content-Type"] = "application/vnd.akamai.papirules.{ruleFormat}+json".format(ruleFormat=ruleFormat)
+        result = await self.put(path=path, headers=headers, body=rules)
+        return result
+
+    async def activate(self, propertyId, propertyVersion, network, emailaddresses, notes=None):
+        path = "/papi/v1/properties/{propertyId}/activations".format(propertyId=propertyId)
+        body = {
+            "acknowledgeAllWarnings": True,
+            "activationType": "ACTIVATE",
+            "network": network,
+            "notifyEmails": emailaddresses.split(),
+            "note": notes,
+            "propertyVersion": propertyVersion,
+        }
+
+        result = await self.post(path=path, body=body)
+        return result
@@ -1,8 +1,33 @@
 from akamai.edgegrid import EdgeGridAuth, EdgeRc
 import os.path
 import os
+import sys
 import requests
-import json
+from . import jsonbackend
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 120
+DEFAULT_MAX_RETRIES = 5
+
+## Backoff doubles from BACKOFF_BASE seconds on each retry, up to BACKOFF_MAX, with full jitter
+BACKOFF_BASE = 1
+BACKOFF_MAX = 60
+RETRYABLE_STATUSES = [429, 500, 502, 503, 504]
+
+## Pooled sessions shared by every client in the process, keyed by credential set
+SESSIONS = {}
+SESSIONS_LOCK = threading.Lock()
+
+## Rate limiters shared by every client in the process, keyed by credential set
+RATE_LIMITERS = {}
+RATE_LIMITERS_LOCK = threading.Lock()
 
 
 def get_credentials_from_edgerc(edgerc_path, section):
@@ -43,8 +68,109 @@ def get_credentials_from_environment(section):
     return credentials
 
 
+def get_session(credentials, pool_size=DEFAULT_POOL_SIZE):
+    session_key = (
+        credentials["host"],
+        credentials["client_token"],
+        credentials["access_token"],
+        credentials["client_secret"],
+    )
+    with SESSIONS_LOCK:
+        if session_key not in SESSIONS:
+            session = requests.Session()
+            session.auth = EdgeGridAuth(
+                client_token=credentials["client_token"],
+                client_secret=credentials["client_secret"],
+                access_token=credentials["access_token"],
+            )
+            ## Keep-alive connections are reused by every request made with these credentials
+            adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+            session.mount("https://", adapter)
+            SESSIONS[session_key] = session
+        return SESSIONS[session_key]
+
+
+class RateLimiter:
+    ## Token bucket allowing rate requests per second on average, in bursts of up to burst requests.
+    ## A rate of None only enforces pauses, which are set when the API reports a rate limit has been reached
+    def __init__(self, rate=None, burst=None):
+        self.rate = rate
+        self.burst = burst if burst is not None else max(1, rate or 1)
+        self.tokens = self.burst
+        self.updated = time.monotonic()
+        self.paused_until = 0
+        self.lock = threading.Lock()
+
+    def try_acquire(self):
+        ## Takes a token if one is available, otherwise returns the seconds to wait before trying again
+        with self.lock:
+            now = time.monotonic()
+            wait = self.paused_until - now
+            if wait > 0:
+                return wait
+            if self.rate is None:
+                return 0
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            if self.tokens >= 1:
+                self.tokens -= 1
+                return 0
+            return (1 - self.tokens) / self.rate
+
+    def acquire(self):
+        wait = self.try_acquire()
+        while wait > 0:
+            time.sleep(wait)
+            wait = self.try_acquire()
+
+    def pause(self, seconds):
+        with self.lock:
+            self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+
+def get_rate_limiter(credentials, rate=None, burst=None):
+    limiter_key = (credentials["host"], credentials["client_token"])
+    with RATE_LIMITERS_LOCK:
+        if limiter_key not in RATE_LIMITERS:
+            RATE_LIMITERS[limiter_key] = RateLimiter(rate, burst)
+        return RATE_LIMITERS[limiter_key]
+
+
+def get_retry_delay(response_headers):
+    ## Seconds the API has asked us to wait, from Retry-After or Akamai's X-RateLimit-Next, or None if not given
+    retry_after = response_headers.get("retry-after")
+    if retry_after is not None:
+        if retry_after.strip().isdigit():
+            return float(retry_after)
+        try:
+            return max(0, (parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds())
+        except (TypeError, ValueError):
+            pass
+
+    rate_limit_next = response_headers.get("x-ratelimit-next")
+    if rate_limit_next is not None:
+        try:
+            next_request = datetime.fromisoformat(rate_limit_next.replace("Z", "+00:00"))
+            return max(0, (next_request - datetime.now(timezone.utc)).total_seconds())
+        except ValueError:
+            pass
+    return None
+
+
 class Akamai:
-    def __init__(self, edgerc=None, section=None, accountSwitchKey=None):
+    def __init__(
+        self,
+        edgerc=None,
+        section=None,
+        accountSwitchKey=None,
+        poolSize=None,
+        timeout=None,
+        connectTimeout=None,
+        readTimeout=None,
+        maxRetries=None,
+        rateLimit=None,
+        rateLimitBurst=None,
+    ):
         self.DEFAULT_EDGERC = "~/.edgerc"
         self.DEFAULT_SECTION = "default"
 
@@ -76,6 +202,32 @@ class Akamai:
         if accountSwitchKey:
             self.credentials["account_key"] = accountSwitchKey
 
+        if poolSize is not None:
+            self.pool_size = poolSize
+        else:
+            self.pool_size = DEFAULT_POOL_SIZE
+
+        ## Seconds to wait for each request, either a single value or a (connect, read) tuple. None waits indefinitely
+        if timeout is not None:
+            self.timeout = timeout
+        else:
+            self.timeout = (
+                connectTimeout if connectTimeout is not None else DEFAULT_CONNECT_TIMEOUT,
+                readTimeout if readTimeout is not None else DEFAULT_READ_TIMEOUT,
+            )
+
+        ## Retries of rate limited, failed and timed out requests, with exponential backoff
+        self.max_retries = maxRetries if maxRetries is not None else DEFAULT_MAX_RETRIES
+
+        ## Requests per second allowed across every client and thread using these credentials
+        self.rate_limiter = get_rate_limiter(self.credentials, rateLimit, rateLimitBurst)
+
+        ## ETag and body of the last response to each conditional GET, keyed by URL
+        self.conditional_responses = {}
+
+        ## If set, called with the method, path, status, response size, start time and duration of every request
+        self.request_hook = None
+
     def get_edgerc(self):
         return self.edgerc
 
@@ -100,13 +252,14 @@ class Akamai:
     def get_credentials(self):
         return self.credentials
 
-    def do(self, method, path, query, headers, body=None):
-        self.baseurl = "https://" + self.credentials["host"]
+    def prepare(self, method, path, query, headers, body=None, conditional=False):
+        ## Request state is kept local so a single client can be shared between threads
+        base_url = "https://" + self.credentials["host"]
 
-        self.headers = {"PAPI-Use-Prefixes": "false", "accept": "application/json", "connection": "close"}
+        request_headers = {"PAPI-Use-Prefixes": "false", "accept": "application/json"}
 
         if body is not None:
-            self.headers["content-type"] = "application/json"
+            request_headers["content-type"] = "application/json"
 
         # Append accountSwitchKey query param
         if self.credentials["account_key"] is not None:
@@ -121,49 +274,122 @@ class Akamai:
 
         # Append query
         if query is not None:
-            request_url = self.baseurl + path + "?" + query
+            request_url = base_url + path + "?" + query
         else:
-            request_url = self.baseurl + path
+            request_url = base_url + path
 
         # Override headers
         if headers is not None:
             for header in headers.keys():
-                self.headers[header] = headers[header]
+                request_headers[header] = headers[header]
+
+        # Revalidate conditional requests, so unchanged resources are not sent again
+        previous_response = None
+        if conditional:
+            previous_response = self.conditional_responses.get(request_url)
+            if previous_response is not None:
+                request_headers["if-none-match"] = previous_response[0]
 
         # Body could be a dict. If so convert to json string
         if not isinstance(body, str):
-            body = json.dumps(body)
+            body = jsonbackend.dumps(body)
 
-        ## Property handle keep-alives and other open sessions
-        with requests.Session() as session:
-            session.auth = EdgeGridAuth(
-                client_token=self.credentials["client_token"],
-                client_secret=self.credentials["client_secret"],
-                access_token=self.credentials["access_token"],
-            )
+        return request_url, request_headers, body, previous_response
+
+    def do(self, method, path, query, headers, body=None, conditional=False, idempotent=None):
+        request_url, request_headers, body, previous_response = self.prepare(
+            method, path, query, headers, body, conditional
+        )
 
+        # POSTs may create something, so are only retried if the request can't have been processed
+        if idempotent is None:
+            idempotent = method != "POST"
+
+        session = get_session(self.credentials, self.pool_size)
+
+        attempt = 0
+        while True:
+            self.rate_limiter.acquire()
+            start = time.perf_counter()
             try:
                 if method == "GET":
-                    result = session.get(request_url, headers=self.headers)
+                    result = session.get(request_url, headers=request_headers, timeout=self.timeout)
                 elif method == "POST":
-                    result = session.post(request_url, headers=self.headers, data=body)
+                    result = session.post(request_url, headers=request_headers, data=body, timeout=self.timeout)
                 elif method == "PUT":
-                    result = session.put(request_url, headers=self.headers, data=body)
+                    result = session.put(request_url, headers=request_headers, data=body, timeout=self.timeout)
             except requests.exceptions.RequestException as err:
-                print(err)
-                return
-
-            # 4xx/5xx errors do not always throw, so manually do so
-            if result is not None and result.status_code >= 400:
-                raise ValueError(str(result.status_code) + " response: " + result.text)
-            else:
-                return json.loads(result.content)
-
-    def get(self, path, query=None, headers=None):
-        return self.do("GET", path, query, headers)
-
-    def post(self, path, query=None, headers=None, body=None):
-        return self.do("POST", path, query, headers, body)
+                self.report_request(method, path, start)
+                retryable = not isinstance(err, requests.exceptions.SSLError) and (
+                    isinstance(err, requests.exceptions.ConnectTimeout)
+                    or (
+                        idempotent
+                        and isinstance(err, (requests.exceptions.ConnectionError, requests.exceptions.Timeout))
+                    )
+                )
+                if not retryable or attempt >= self.max_retries:
+                    raise
+                self.wait_to_retry(method, path, attempt, str(err), self.get_backoff(attempt))
+                attempt += 1
+                continue
+            self.report_request(method, path, start, result.status_code, len(result.content))
+
+            # If the last request allowed has been used, wait for the limit to reset before sending any more
+            if result.headers.get("x-ratelimit-remaining") == "0":
+                self.rate_limiter.pause(get_retry_delay(result.headers) or 0)
+
+            # Rate limited requests were not processed, so are always safe to retry
+            retryable = result.status_code == 429 or (idempotent and result.status_code in RETRYABLE_STATUSES)
+            if not retryable or attempt >= self.max_retries:
+                break
+            delay = self.get_backoff(attempt, get_retry_delay(result.headers))
+            if result.status_code == 429:
+                ## Hold back every thread sharing these credentials until the limit resets
+                self.rate_limiter.pause(delay)
+            self.wait_to_retry(method, path, attempt, str(result.status_code) + " response", delay)
+            attempt += 1
+
+        return self.parse_response(
+            request_url, result.status_code, result.headers, result.content, conditional, previous_response
+        )
+
+    def parse_response(self, request_url, status, response_headers, content, conditional, previous_response):
+        # 4xx/5xx errors do not always throw, so manually do so
+        if status >= 400:
+            raise ValueError(str(status) + " response: " + content.decode("utf-8", errors="replace"))
+        elif status == 304 and previous_response is not None:
+            return jsonbackend.loads(previous_response[1])
+        else:
+            if conditional and "etag" in response_headers:
+                self.conditional_responses[request_url] = (response_headers["etag"], content)
+            return jsonbackend.loads(content)
+
+    def get_backoff(self, attempt, retry_delay=None):
+        ## Full jitter, so concurrent clients retrying together spread out, but never sooner than the API asked
+        delay = random.uniform(0, min(BACKOFF_MAX, BACKOFF_BASE * 2**attempt))
+        if retry_delay is not None:
+            delay = max(delay, retry_delay)
+        return delay
+
+    def log_retry(self, method, path, attempt, reason, delay):
+        print(
+            f"{method} {path} failed with {reason}. Retrying in {delay:.1f}s ({attempt + 1} of {self.max_retries})",
+            file=sys.stderr,
+        )
+
+    def wait_to_retry(self, method, path, attempt, reason, delay):
+        self.log_retry(method, path, attempt, reason, delay)
+        time.sleep(delay)
+
+    def report_request(self, method, path, start, status=None, size=0):
+        if self.request_hook is not None:
+            self.request_hook(method, path, status, size, start, time.perf_counter() - start)
+
+    def get(self, path, query=None, headers=None, conditional=False):
+        return self.do("GET", path, query, headers, conditional=conditional)
+
+    def post(self, path, query=None, headers=None, body=None, idempotent=False):
+        return self.do("POST", path, query, headers, body, idempotent=idempotent)
 
     def put(self, path, query=None, headers=None, body=None):
         return self.do("PUT", path, query, headers, body)
@@ -0,0 +1,98 @@
+import json
+import os
+import re
+
+## orjson is optional. When installed it is used unless PYPELINE_JSON_BACKEND=json, and output always matches json's
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+BACKENDS = ["orjson", "json"]
+BACKEND = "orjson" if orjson is not None and os.environ.get("PYPELINE_JSON_BACKEND", "orjson") == "orjson" else "json"
+
+## json and orjson format some floats differently, so output containing a float is left to json. Indented numbers
+## always end a line, and compact ones are followed by a separator, while strings end in a quote
+FLOAT_MATCHES = {
+    2: [re.compile(rb"\.\d+,?\n"), re.compile(rb"e-?\d+,?\n")],
+    None: [re.compile(rb"\.\d+[,}\]]"), re.compile(rb"e-?\d+[,}\]]")],
+}
+
+## orjson reads integers beyond 64 bits as floats, so input with 19 or more digits in a row is left to json
+DIGITS = bytes.maketrans(b"123456789", b"000000000")
+LONG_NUMBER = b"0" * 19
+
+
+def set_backend(backend):
+    global BACKEND
+    if backend not in BACKENDS:
+        raise (Exception(f"Unknown JSON backend '{backend}'. Choose from: {', '.join(BACKENDS)}"))
+    if backend == "orjson" and orjson is None:
+        raise (Exception("The orjson JSON backend requires orjson. Install it with: python -m pip install orjson"))
+    BACKEND = backend
+
+
+def loads(data):
+    if BACKEND == "orjson":
+        encoded = data.encode("utf-8", "surrogatepass") if isinstance(data, str) else data
+        if LONG_NUMBER not in encoded.translate(DIGITS):
+            try:
+                return orjson.loads(encoded)
+            except orjson.JSONDecodeError:
+                ## json also accepts NaN and lone surrogates, so give it the final say
+                pass
+    return json.loads(data)
+
+
+def load(file):
+    return loads(file.read())
+
+
+def read(file_path):
+    ## orjson parses bytes directly, so the file needn't be decoded first
+    if BACKEND == "orjson":
+        with open(file_path, "rb") as file:
+            return loads(file.read())
+    with open(file_path, "r") as file:
+        return json.load(file)
+
+
+def dumps(value, indent=None, sort_keys=False):
+    ## Without an indent the output is compact, with no spaces after separators
+    if BACKEND == "orjson" and indent in FLOAT_MATCHES and isinstance(value, (dict, list)):
+        option = (orjson.OPT_INDENT_2 if indent == 2 else 0) | (orjson.OPT_SORT_KEYS if sort_keys else 0)
+        try:
+            output = orjson.dumps(value, option=option)
+        except TypeError:
+            output = None
+        ## json also escapes everything outside printable ASCII
+        if (
+            output is not None
+            and output.isascii()
+            and b"\x7f" not in output
+            and not any(float_match.search(output) for float_match in FLOAT_MATCHES[indent])
+        ):
+            return output.decode()
+    return json.dumps(value, indent=indent, sort_keys=sort_keys, separators=(",", ":") if indent is None else None)
+
+
+def dump(value, file, indent=None, sort_keys=False):
+    file.write(dumps(value, indent, sort_keys))
+
+
+def copy(value):
+    ## Copy a parsed JSON tree. A round trip through orjson is quicker than copying its dicts and lists in Python
+    if BACKEND == "orjson":
+        try:
+            return orjson.loads(orjson.dumps(value))
+        except TypeError:
+            pass
+    return copy_tree(value)
+
+
+def copy_tree(value):
+    if isinstance(value, dict):
+        return {key: copy_tree(item) for key, item in value.items()}
+    elif isinstance(value, list):
+        return [copy_tree(item) for item in value]
+    return value
@@ -26,11 +26,31 @@ class Property(Akamai):
         result = self.get(path=path)
         return result["activations"]["items"]
 
-    def getProperty(self, propertyId):
+    def getActivation(self, propertyId, activationId):
+        path = "/papi/v1/properties/{propertyId}/activations/{activationId}".format(
+            propertyId=propertyId, activationId=activationId
+        )
+        result = self.get(path=path, conditional=True)
+        return result["activations"]["items"][0]
+
+    def getProperty(self, propertyId, contractId=None, groupId=None):
         path = "/papi/v1/properties/{propertyId}".format(propertyId=propertyId)
-        result = self.get(path=path)
+        query = None
+        if contractId is not None and groupId is not None:
+            query = "contractId={contractId}&groupId={groupId}".format(contractId=contractId, groupId=groupId)
+        result = self.get(path=path, query=query)
         return result["properties"]["items"][0]
 
+    def getPropertyVersion(self, propertyId, propertyVersion, contractId=None, groupId=None):
+        path = "/papi/v1/properties/{propertyId}/versions/{propertyVersion}".format(
+            propertyId=propertyId, propertyVersion=propertyVersion
+        )
+        query = None
+        if contractId is not None and groupId is not None:
+            query = "contractId={contractId}&groupId={groupId}".format(contractId=contractId, groupId=groupId)
+        result = self.get(path=path, query=query)
+        return result["versions"]["items"][0]
+
     def getPropertyRules(self, propertyId, propertyVersion, ruleFormat=None):
         path = "/papi/v1/properties/{propertyId}/versions/{propertyVersion}/rules".format(
             propertyId=propertyId, propertyVersion=propertyVersion
@@ -43,13 +63,13 @@ class Property(Akamai):
 
     def bulkSearch(self, body):
         path = "/papi/v1/bulk/rules-search-requests-synch"
-        result = self.post(path=path, body=body)
+        result = self.post(path=path, body=body, idempotent=True)
         return result["results"]
 
     def findProperty(self, propertyName):
         path = "/papi/v1/search/find-by-value"
         body = {"propertyName": propertyName}
-        result = self.post(path=path, body=body)
+        result = self.post(path=path, body=body, idempotent=True)
         return result["versions"]["items"]
 
     def newPropertyVersion(self, propertyId, createFromVersion):
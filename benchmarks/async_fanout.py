@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ak.async_property import AsyncProperty
+from ak.property import Property
+from session_reuse import start_stub_server
+
+PROPERTY_NAMES = ["www.example.com"]
+
+
+def threaded_fanout(request_count, threads):
+    ## Current CLI fan-out: a bounded thread pool sharing one pooled client
+    client = Property(poolSize=threads)
+    with ThreadPoolExecutor(max_workers=threads) as executor:
+        list(executor.map(client.findProperty, PROPERTY_NAMES * request_count))
+
+
+async def async_fanout(request_count, connections):
+    ## Every request in flight at once from a single event loop, bounded by the connection pool
+    async with AsyncProperty(poolSize=connections) as client:
+        await asyncio.gather(*[client.findProperty(name) for name in PROPERTY_NAMES * request_count])
+
+
+@click.command()
+@click.option("--requests", "request_count", default=200, help="Number of concurrent property lookups")
+@click.option("--threads", default=10, help="Thread pool size for the threaded client")
+@click.option("--connections", default=100, help="Connection pool size for the async client")
+@click.option("--response-delay", default=0.1, help="Seconds the stub server takes to answer each request")
+def main(request_count, threads, connections, response_delay):
+    """
+    Compare fanning out property lookups on a thread pool with the asyncio client
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, cert_file = start_stub_server(work_dir, 0, response_delay)
+        os.environ["REQUESTS_CA_BUNDLE"] = cert_file
+        os.environ["AKAMAI_HOST"] = "127.0.0.1:%d" % server.server_address[1]
+        os.environ["AKAMAI_CLIENT_TOKEN"] = "akab-client-token"
+        os.environ["AKAMAI_ACCESS_TOKEN"] = "akab-access-token"
+        os.environ["AKAMAI_CLIENT_SECRET"] = "client-secret"
+
+        start = time.perf_counter()
+        threaded_fanout(request_count, threads)
+        threaded = time.perf_counter() - start
+
+        start = time.perf_counter()
+        asyncio.run(async_fanout(request_count, connections))
+        asynchronous = time.perf_counter() - start
+
+        server.shutdown()
+
+    click.echo(f"Thread pool ({threads} threads):          {threaded:.2f} s")
+    click.echo(f"Async client ({connections} connections): {asynchronous:.2f} s")
+    click.secho(f"Speedup: {threaded / asynchronous:.1f}x", fg="green")
+
+
+if __name__ == "__main__":
+    main()
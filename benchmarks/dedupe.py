@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import time
+import click
+
+from pipeline_stages import DEMO_PIPELINE, generate_scaled_demo_pipeline
+from ak import jsonbackend
+import utilities
+
+
+def get_folder_size(folder):
+    file_count = 0
+    total_bytes = 0
+    for root, _, file_names in os.walk(folder):
+        for file_name in file_names:
+            file_count += 1
+            total_bytes += os.path.getsize(os.path.join(root, file_name))
+    return file_count, total_bytes
+
+
+def time_split(rules, templates_dir, dedupe, repeat):
+    times = []
+    for attempt in range(repeat):
+        start = time.perf_counter()
+        utilities.split_rules(utilities.copy_json(rules), templates_dir + str(attempt), False, dedupe=dedupe)
+        times.append(time.perf_counter() - start)
+    return min(times), templates_dir + "0"
+
+
+def time_merge(templates_dir, repeat):
+    ## Templates are read from disk every time, as for a new merge process
+    times = []
+    for _ in range(repeat):
+        utilities.clear_template_cache()
+        start = time.perf_counter()
+        rules = utilities.merge_rules(templates_dir + "/main.json")
+        times.append(time.perf_counter() - start)
+    return min(times), rules
+
+
+@click.command()
+@click.option("--scale", default=20, help="Number of copies of the demo pipeline's top level rules")
+@click.option("--repeat", default=5, help="Number of timed runs of each stage")
+def main(scale, repeat):
+    """
+    Compare importing and merging templates split one file per rule with deduplicated templates
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        ## Repeated top level rules share identical children, as repeated caching or compression blocks would
+        generate_scaled_demo_pipeline(work_dir + "/pipeline", scale)
+        rules = utilities.merge_rules(work_dir + "/pipeline/templates/main.json")
+        expected = jsonbackend.dumps(rules, indent=2)
+
+        results = {}
+        for name, dedupe in [("one per rule", False), ("deduplicated", True)]:
+            split_seconds, templates_dir = time_split(rules, f"{work_dir}/{name}", dedupe, repeat)
+            merge_seconds, merged = time_merge(templates_dir, repeat)
+            if jsonbackend.dumps(merged, indent=2) != expected:
+                click.secho(f"Merged rules differ from the imported rules when {name}", fg="red")
+                sys.exit(1)
+            results[name] = get_folder_size(templates_dir) + (split_seconds, merge_seconds)
+
+    click.echo(f"Demo pipeline from {DEMO_PIPELINE} repeated {scale} times")
+    click.echo(f"{'Templates':<14}{'Files':>8}{'KB':>10}{'Split':>12}{'Merge':>12}")
+    for name, (file_count, total_bytes, split_seconds, merge_seconds) in results.items():
+        click.echo(
+            f"{name:<14}{file_count:>8}{total_bytes / 1024:>10.0f}"
+            f"{split_seconds * 1000:>9.1f} ms{merge_seconds * 1000:>9.1f} ms"
+        )
+    plain, deduplicated = results["one per rule"], results["deduplicated"]
+    click.secho(
+        f"{plain[0] / deduplicated[0]:.1f}x fewer files, import {plain[2] / deduplicated[2]:.1f}x "
+        f"and merge {plain[3] / deduplicated[3]:.1f}x faster",
+        fg="green",
+    )
+
+
+if __name__ == "__main__":
+    main()
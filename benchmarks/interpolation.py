@@ -0,0 +1,107 @@
+import copy
+import json
+import os
+import sys
+import time
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import utilities
+
+
+def build_rules(depth, breadth, variable_count):
+    ## Build a synthetic rule tree with value variable tokens spread across its behaviors
+    token_index = [0]
+
+    def next_token():
+        token_index[0] += 1
+        return "${env.var_%d}" % (token_index[0] % variable_count)
+
+    def build_rule(name, level):
+        rule = {
+            "name": name,
+            "children": [],
+            "behaviors": [
+                {"name": "origin", "options": {"hostname": next_token(), "httpPort": next_token()}},
+                {"name": "caching", "options": {"enabled": next_token(), "ttl": "7d"}},
+            ],
+            "criteria": [],
+            "comments": "Synthetic rule " + name,
+        }
+        if level < depth:
+            for index in range(breadth):
+                rule["children"].append(build_rule(f"{name}/{index}", level + 1))
+        return rule
+
+    return {"rules": build_rule("default", 0)}
+
+
+def build_variables(variable_count):
+    ## Cycle through string, int and bool values to exercise each typing rule
+    variables = {}
+    for index in range(variable_count):
+        if index % 3 == 0:
+            variables[f"var_{index}"] = f"origin-{index}.example.com"
+        elif index % 3 == 1:
+            variables[f"var_{index}"] = index
+        else:
+            variables[f"var_{index}"] = bool(index % 2)
+    return variables
+
+
+def legacy_interpolate(rules, variables):
+    ## Previous merge_pipeline implementation: one serialise/replace/parse round trip per variable
+    for name, value in variables.items():
+        rules_str = json.dumps(rules)
+        if isinstance(value, bool):
+            rules_str = rules_str.replace('"${env.%s}"' % name, json.dumps(value))
+        elif isinstance(value, int):
+            rules_str = rules_str.replace('"${env.%s}"' % name, str(value))
+        else:
+            rules_str = rules_str.replace("${env.%s}" % name, value)
+        rules = json.loads(rules_str)
+    return rules
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option("--depth", default=4, help="Depth of the synthetic rule tree")
+@click.option("--breadth", default=6, help="Children per rule")
+@click.option("--variables", "variable_count", default=150, help="Number of value variables")
+@click.option("--repeat", default=3, help="Number of timed runs per implementation")
+def main(depth, breadth, variable_count, repeat):
+    """
+    Compare single-pass interpolation with the previous per-variable loop
+    """
+    rules = build_rules(depth, breadth, variable_count)
+    variables = build_variables(variable_count)
+    size = len(json.dumps(rules))
+    click.echo(f"Rule tree: {size / 1024:.0f} KB, {variable_count} variables")
+
+    legacy_times = []
+    single_pass_times = []
+    for _ in range(repeat):
+        legacy_result, elapsed = time_call(legacy_interpolate, copy.deepcopy(rules), variables)
+        legacy_times.append(elapsed)
+        single_pass_result, elapsed = time_call(utilities.interpolate_variables, copy.deepcopy(rules), variables)
+        single_pass_times.append(elapsed)
+
+    if legacy_result != single_pass_result:
+        click.secho("Results differ between implementations", fg="red")
+        sys.exit(1)
+
+    legacy_best = min(legacy_times)
+    single_pass_best = min(single_pass_times)
+    click.echo(f"Per-variable loop: {legacy_best * 1000:.1f} ms")
+    click.echo(f"Single pass:       {single_pass_best * 1000:.1f} ms")
+    click.secho(f"Speedup: {legacy_best / single_pass_best:.1f}x", fg="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,80 @@
+import os
+import sys
+import tempfile
+import time
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ak import jsonbackend
+from pipeline_stages import build_rules
+import utilities
+
+
+def merge_templates(templates_dir):
+    utilities.clear_template_cache()
+    utilities.merge_rules(templates_dir + "/main.json")
+
+
+def get_operations(rules, rules_file, templates_dir):
+    return {
+        "read": lambda: jsonbackend.read(rules_file),
+        "dump indented": lambda: jsonbackend.dumps(rules, indent=2),
+        "dump compact": lambda: jsonbackend.dumps(rules),
+        "copy": lambda: utilities.copy_json(rules),
+        "merge templates": lambda: merge_templates(templates_dir),
+    }
+
+
+def time_operation(operation, repeat):
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        operation()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+@click.command()
+@click.option("--depth", default=5, help="Depth of the synthetic rule tree")
+@click.option("--breadth", default=5, help="Children per rule")
+@click.option("--repeat", default=5, help="Number of timed runs per operation")
+def main(depth, breadth, repeat):
+    """
+    Compare the orjson and json backends on a large rule tree, checking their output is identical
+    """
+    if jsonbackend.orjson is None:
+        click.secho("orjson is not installed. Install it with: python -m pip install orjson", fg="red")
+        sys.exit(1)
+
+    rules, _ = build_rules(depth, breadth, 100, ["dev", "stage", "prod"], 1)
+    outputs = {}
+    results = {}
+    with tempfile.TemporaryDirectory() as work_dir:
+        rules_file = work_dir + "/rules.json"
+        with open(rules_file, "w") as f:
+            jsonbackend.dump(rules, f, indent=2)
+        ## Also split into templates, as import does
+        templates_dir = work_dir + "/templates"
+        utilities.split_rules(utilities.copy_json(rules), templates_dir, False)
+        for backend in ["json", "orjson"]:
+            jsonbackend.set_backend(backend)
+            outputs[backend] = (jsonbackend.dumps(rules, indent=2), jsonbackend.dumps(rules))
+            for name, operation in get_operations(rules, rules_file, templates_dir).items():
+                results.setdefault(name, {})[backend] = time_operation(operation, repeat)
+
+    if outputs["json"] != outputs["orjson"]:
+        click.secho("Output differs between backends", fg="red")
+        sys.exit(1)
+
+    click.echo(f"Rule tree: {len(outputs['json'][0]) / 1024:.0f} KB indented")
+    click.echo(f"{'Operation':<16}{'json':>12}{'orjson':>12}{'Speedup':>10}")
+    for name, times in results.items():
+        click.echo(
+            f"{name:<16}{times['json'] * 1000:>9.1f} ms{times['orjson'] * 1000:>9.1f} ms"
+            f"{times['json'] / times['orjson']:>9.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+import copy
+import sys
+import time
+import click
+
+from pipeline_stages import build_rules
+import utilities
+
+
+def legacy_apply(rules, path_values):
+    ## Previous merge_pipeline implementation: parse, find and update each path in turn
+    from jsonpath_ng.ext import parse
+
+    for path, value in path_values:
+        expression = parse(path)
+        if len(expression.find(rules)) > 0:
+            expression.update(rules, value)
+    return rules
+
+
+def get_overlapping_cases():
+    ## Variables whose paths overlap, where each must see the rules as the variables before it left them
+    replacement_rule = {"name": "replaced", "children": [], "behaviors": [{"name": "origin", "options": {}}]}
+    return {
+        "rule replaced, then its name set": [
+            ("$.rules.children[1]", copy.deepcopy(replacement_rule)),
+            ("$.rules.children[1].name", "after-replace"),
+        ],
+        "options replaced, then a nested option set": [
+            ("$.rules.behaviors[0].options", {"hostname": "replaced.example.com", "httpPort": 80}),
+            ("$.rules.behaviors[0].options.hostname", "after-replace.example.com"),
+        ],
+        "nested option set, then its options replaced": [
+            ("$.rules.behaviors[0].options.hostname", "before-replace.example.com"),
+            ("$.rules.behaviors[0].options", {"hostname": "replaced.example.com"}),
+        ],
+        "rule replaced, then a wildcard below it set": [
+            ("$.rules.children[2]", copy.deepcopy(replacement_rule)),
+            ("$.rules.children[*].behaviors[0].options.hostname", "wildcard.example.com"),
+        ],
+        "name set, then a filter on it": [
+            ("$.rules.children[0].name", "renamed"),
+            ("$.rules.children[?(@.name=='renamed')].comments", "found by filter"),
+        ],
+    }
+
+
+def get_timed_paths(hostname_paths, breadth):
+    ## Positional variables on every origin hostname, and a filter per top level rule sharing its prefix
+    path_values = [(path, f"origin-{index}.example.com") for index, path in enumerate(hostname_paths)]
+    for index in range(breadth):
+        path_values.append((f"$.rules.children[{index}].children[*].behaviors[?(@.name=='caching')].options.ttl", "1d"))
+    return path_values
+
+
+def time_call(function, *args):
+    start = time.perf_counter()
+    result = function(*args)
+    return result, time.perf_counter() - start
+
+
+@click.command()
+@click.option("--depth", default=4, help="Depth of the synthetic rule tree")
+@click.option("--breadth", default=6, help="Children per rule")
+@click.option("--repeat", default=3, help="Number of timed runs per implementation")
+def main(depth, breadth, repeat):
+    """
+    Check positional variables apply as they did one at a time, including overlapping paths, and compare timings
+    """
+    rules, hostname_paths = build_rules(depth, breadth, 10, ["dev"], 1)
+
+    failed = False
+    for name, path_values in get_overlapping_cases().items():
+        ## Values are copied too, as a replaced rule is then changed by the paths below it
+        expected = legacy_apply(copy.deepcopy(rules), copy.deepcopy(path_values))
+        if utilities.apply_variables_by_jsonpath(copy.deepcopy(rules), copy.deepcopy(path_values)) != expected:
+            click.secho(f"Results differ from applying one at a time: {name}", fg="red")
+            failed = True
+    if failed:
+        sys.exit(1)
+
+    path_values = get_timed_paths(hostname_paths, breadth)
+    click.echo(f"{len(path_values)} positional variables")
+    legacy_times = []
+    batched_times = []
+    for _ in range(repeat):
+        legacy_result, elapsed = time_call(legacy_apply, copy.deepcopy(rules), path_values)
+        legacy_times.append(elapsed)
+        batched_result, elapsed = time_call(utilities.apply_variables_by_jsonpath, copy.deepcopy(rules), path_values)
+        batched_times.append(elapsed)
+
+    if legacy_result != batched_result:
+        click.secho("Results differ between implementations", fg="red")
+        sys.exit(1)
+
+    legacy_best = min(legacy_times)
+    batched_best = min(batched_times)
+    click.echo(f"One at a time: {legacy_best * 1000:.1f} ms")
+    click.echo(f"Batched:       {batched_best * 1000:.1f} ms")
+    click.secho(f"Speedup: {legacy_best / batched_best:.1f}x", fg="green")
+
+
+if __name__ == "__main__":
+    main()
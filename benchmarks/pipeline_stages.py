@@ -0,0 +1,284 @@
+import datetime
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+import click
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+import pypeline
+import utilities
+
+DEMO_PIPELINE = REPO_DIR + "/example/demopipeline"
+DEFAULT_RESULTS_FILE = REPO_DIR + "/benchmarks/results.jsonl"
+
+
+def build_rules(depth, breadth, variable_count, environment_names, seed):
+    ## Build a synthetic rule tree, returning it with the jsonPath of every origin hostname for positional variables
+    random_generator = random.Random(seed)
+    hostname_paths = []
+
+    def next_token():
+        return "${env.var_%d}" % random_generator.randrange(variable_count)
+
+    def build_rule(name, path, level):
+        comments = "Synthetic rule " + name
+        ## Scope roughly one rule in five to a single environment
+        if level > 0 and random_generator.random() < 0.2:
+            comments = "pypeline_env:" + random_generator.choice(environment_names) + "; " + comments
+        rule = {
+            "name": name,
+            "children": [],
+            "behaviors": [
+                {"name": "origin", "options": {"hostname": next_token(), "httpPort": next_token()}},
+                {"name": "caching", "options": {"behavior": "MAX_AGE", "mustRevalidate": False, "ttl": "7d"}},
+                {"name": "cpCode", "options": {"value": {"id": next_token()}}},
+            ],
+            "criteria": [{"name": "path", "options": {"matchOperator": "MATCHES_ONE_OF", "values": ["/" + name]}}],
+            "criteriaMustSatisfy": "all",
+            "comments": comments,
+        }
+        hostname_paths.append(path + ".behaviors[0].options.hostname")
+        if level < depth:
+            for index in range(breadth):
+                rule["children"].append(build_rule(f"{name} {index}", f"{path}.children[{index}]", level + 1))
+        return rule
+
+    rules = build_rule("default", "$.rules", 0)
+    rules["variables"] = [{"name": "PMUSER_ENV", "value": "", "description": "", "hidden": False, "sensitive": False}]
+    return {"rules": rules}, hostname_paths
+
+
+def write_pipeline(work_dir, rules, variable_definitions, environment_variables):
+    ## Lay out a pipeline folder the same way the create and import commands do
+    config = {"name": "benchmark", "ruleFormat": "latest", "environments": []}
+    for name, variables in environment_variables.items():
+        config["environments"].append({"name": name, "propertyName": name + ".example.com"})
+        os.makedirs(work_dir + "/environments/" + name)
+        with open(work_dir + "/environments/" + name + "/variables.json", "w") as f:
+            json.dump(variables, f, indent=2)
+        with open(work_dir + "/environments/" + name + "/hostnames.json", "w") as f:
+            json.dump([], f)
+    with open(work_dir + "/pipeline.json", "w") as f:
+        json.dump(config, f, indent=2)
+    with open(work_dir + "/variableDefinitions.json", "w") as f:
+        json.dump(variable_definitions, f, indent=2)
+    utilities.split_rules(utilities.copy_json(rules), work_dir + "/templates", False)
+
+
+def generate_synthetic_pipeline(work_dir, depth, breadth, variable_count, json_path_count, environment_count, seed):
+    environment_names = [f"env{index}" for index in range(environment_count)]
+    rules, hostname_paths = build_rules(depth, breadth, variable_count, environment_names, seed)
+
+    variable_definitions = [{"name": f"var_{index}", "default": f"value-{index}"} for index in range(variable_count)]
+    ## Spread positional variables evenly across the tree
+    step = max(1, len(hostname_paths) // max(1, json_path_count))
+    for index, path in enumerate(hostname_paths[::step][:json_path_count]):
+        variable_definitions.append({"name": f"path_{index}", "default": None, "jsonPaths": [path]})
+
+    environment_variables = {}
+    for name in environment_names:
+        environment_variables[name] = {f"var_{index}": f"{name}-{index}.example.com" for index in range(variable_count)}
+        environment_variables[name].update(
+            {f"path_{index}": f"{name}-origin.example.com" for index in range(json_path_count)}
+        )
+    write_pipeline(work_dir, rules, variable_definitions, environment_variables)
+
+
+def generate_scaled_demo_pipeline(work_dir, scale):
+    ## Repeat the demo pipeline's top level rules, keeping its variables and environments
+    rules = utilities.merge_rules(DEMO_PIPELINE + "/templates/main.json")
+    children = rules["rules"]["children"]
+    rules["rules"]["children"] = []
+    for copy in range(scale):
+        for child in utilities.copy_json(children):
+            if copy > 0:
+                child["name"] = f"{child['name']} {copy}"
+            rules["rules"]["children"].append(child)
+
+    with open(DEMO_PIPELINE + "/variableDefinitions.json", "r") as f:
+        variable_definitions = json.load(f)
+    environment_variables = {}
+    for environment in pypeline.get_config(DEMO_PIPELINE)["environments"]:
+        with open(DEMO_PIPELINE + "/environments/" + environment["name"] + "/variables.json", "r") as f:
+            environment_variables[environment["name"]] = json.load(f)
+    write_pipeline(work_dir, rules, variable_definitions, environment_variables)
+
+
+def get_stages(work_dir, environment_name):
+    ## Each stage is a (prepare, run) pair. prepare builds the inputs outside the timed section
+    main_file = work_dir + "/templates/main.json"
+    templates = utilities.merge_rules(main_file)
+    positional_variables, value_variables = pypeline.get_variable_values(work_dir, environment_name)
+    interpolated = utilities.interpolate_variables(templates, value_variables)
+    rule_scopes = pypeline.compile_rule_scopes(templates["rules"])
+
+    def split(rules):
+        with tempfile.TemporaryDirectory() as split_dir:
+            utilities.split_rules(rules, split_dir, False)
+
+    def stream(_):
+        with open(os.devnull, "w") as f:
+            pypeline.stream_pipeline(work_dir, environment_name, f)
+
+    return {
+        "load": (lambda: None, lambda _: utilities.merge_rules(main_file)),
+        "jsonpath": (
+            lambda: utilities.copy_json(templates),
+            lambda rules: utilities.apply_variables_by_jsonpath(rules, positional_variables),
+        ),
+        "interpolate": (lambda: templates, lambda rules: utilities.interpolate_variables(rules, value_variables)),
+        "scope": (
+            lambda: utilities.copy_json(interpolated["rules"]),
+            lambda rules: pypeline.remove_out_of_scope_rules(rules, environment_name, rule_scopes),
+        ),
+        "merge": (lambda: None, lambda _: pypeline.merge_pipeline(work_dir, environment_name)),
+        "stream": (lambda: None, stream),
+        "split": (lambda: utilities.copy_json(templates), split),
+    }
+
+
+def measure_stage(prepare, run, repeat):
+    ## Best of several timed runs, then one traced run for peak memory. Templates are always read from disk
+    times = []
+    for _ in range(repeat):
+        stage_input = prepare()
+        utilities.clear_template_cache()
+        start = time.perf_counter()
+        run(stage_input)
+        times.append(time.perf_counter() - start)
+
+    stage_input = prepare()
+    utilities.clear_template_cache()
+    tracemalloc.start()
+    run(stage_input)
+    peak_bytes = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {"seconds": min(times), "peak_bytes": peak_bytes}
+
+
+def get_commit():
+    try:
+        result = subprocess.run(
+            ["git", "describe", "--always", "--dirty"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        )
+        return result.stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def get_previous_run(results_file, parameters):
+    ## The most recent stored run with the same parameters
+    previous_run = None
+    if os.path.exists(results_file):
+        with open(results_file, "r") as f:
+            for line in f:
+                run = json.loads(line)
+                if run["parameters"] == parameters:
+                    previous_run = run
+    return previous_run
+
+
+@click.command()
+@click.option("--depth", default=4, help="Depth of the synthetic rule tree")
+@click.option("--breadth", default=5, help="Children per rule")
+@click.option("--variables", "variable_count", default=100, help="Number of value variables")
+@click.option("--json-paths", "json_path_count", default=50, help="Number of positional variables")
+@click.option("--environments", "environment_count", default=3, help="Number of environments")
+@click.option("--seed", default=1, help="Random seed for the synthetic rule tree")
+@click.option(
+    "--demo-scale",
+    "demo_scale",
+    type=int,
+    required=False,
+    help="Benchmark example/demopipeline with its top level rules repeated this many times, instead of a synthetic tree",
+)
+@click.option(
+    "--stage",
+    "stage_names",
+    multiple=True,
+    type=click.Choice(["load", "jsonpath", "interpolate", "scope", "merge", "stream", "split"]),
+    help="Only run these stages. Defaults to all",
+)
+@click.option("--repeat", default=3, help="Number of timed runs per stage")
+@click.option("--results", "results_file", default=DEFAULT_RESULTS_FILE, help="JSON lines file to store results in")
+@click.option("--no-save", "no_save", is_flag=True, default=False, help="Don't store the results of this run")
+def main(
+    depth,
+    breadth,
+    variable_count,
+    json_path_count,
+    environment_count,
+    seed,
+    demo_scale,
+    stage_names,
+    repeat,
+    results_file,
+    no_save,
+):
+    """
+    Time and measure peak memory of each merge and split stage, comparing with the last run with the same parameters
+    """
+    if demo_scale is not None:
+        parameters = {"demo_scale": demo_scale}
+    else:
+        parameters = {
+            "depth": depth,
+            "breadth": breadth,
+            "variables": variable_count,
+            "json_paths": json_path_count,
+            "environments": environment_count,
+            "seed": seed,
+        }
+
+    with tempfile.TemporaryDirectory() as work_dir:
+        if demo_scale is not None:
+            generate_scaled_demo_pipeline(work_dir, demo_scale)
+        else:
+            generate_synthetic_pipeline(
+                work_dir, depth, breadth, variable_count, json_path_count, environment_count, seed
+            )
+        environment_name = pypeline.get_config(work_dir)["environments"][0]["name"]
+        template_count = sum(len(files) for _, _, files in os.walk(work_dir + "/templates"))
+        size = len(json.dumps(utilities.merge_rules(work_dir + "/templates/main.json")))
+        click.echo(f"Rule tree: {size / 1024:.0f} KB in {template_count} template files, merging {environment_name}")
+
+        stages = get_stages(work_dir, environment_name)
+        results = {}
+        for name in stage_names or stages.keys():
+            prepare, run = stages[name]
+            results[name] = measure_stage(prepare, run, repeat)
+
+    previous_run = get_previous_run(results_file, parameters)
+    click.echo(f"{'Stage':<12}{'Time':>12}{'Peak memory':>16}{'Change':>10}")
+    for name, result in results.items():
+        change = ""
+        if previous_run is not None and name in previous_run["results"]:
+            previous_seconds = previous_run["results"][name]["seconds"]
+            change = f"{(result['seconds'] - previous_seconds) / previous_seconds * 100:+.0f}%"
+        click.echo(
+            f"{name:<12}{result['seconds'] * 1000:>9.1f} ms{result['peak_bytes'] / 1024 / 1024:>13.1f} MB{change:>10}"
+        )
+    if previous_run is not None:
+        click.echo(f"Compared with {previous_run['commit']} at {previous_run['timestamp']}")
+
+    if not no_save:
+        with open(results_file, "a") as f:
+            run = {
+                "commit": get_commit(),
+                "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+                "parameters": parameters,
+                "results": results,
+            }
+            f.write(json.dumps(run) + "\n")
+        click.echo(f"Saved results to: {results_file}")
+
+
+if __name__ == "__main__":
+    main()
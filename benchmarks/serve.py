@@ -0,0 +1,122 @@
+import json
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import click
+
+from pipeline_stages import REPO_DIR, generate_synthetic_pipeline
+
+
+def request_rules(socket_path, environment_name):
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+        client.connect(socket_path)
+        client.sendall(environment_name.encode() + b"\n")
+        response = b""
+        while True:
+            chunk = client.recv(1 << 16)
+            if not chunk:
+                break
+            response += chunk
+    return response.decode().rstrip("\n")
+
+
+def wait_for_socket(socket_path, server, timeout=60):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if server.poll() is not None:
+            click.secho(f"serve exited with status {server.returncode}", fg="red")
+            sys.exit(1)
+        if os.path.exists(socket_path):
+            return
+        time.sleep(0.05)
+    click.secho("Timed out waiting for serve to start", fg="red")
+    sys.exit(1)
+
+
+def edit_template(template_files, random_generator, edit):
+    ## Rename a random template's rule, as an edit in an editor would
+    file_path = random_generator.choice(template_files)
+    with open(file_path, "r") as f:
+        rule = json.load(f)
+    rule["name"] = f"Edited rule {edit}"
+    with open(file_path, "w") as f:
+        json.dump(rule, f, indent=2)
+
+
+@click.command()
+@click.option("--depth", default=4, help="Depth of the synthetic rule tree")
+@click.option("--breadth", default=6, help="Children per rule")
+@click.option("--environments", "environment_count", default=3, help="Number of environments")
+@click.option("--edits", default=20, help="Number of template edits to time")
+@click.option("--seed", default=1, help="Random seed for the pipeline and the templates edited")
+def main(depth, breadth, environment_count, edits, seed):
+    """
+    Compare running merge after each edit with asking a running serve for merged rules over its socket
+    """
+    random_generator = random.Random(seed)
+    pypeline_script = REPO_DIR + "/pypeline.py"
+    with tempfile.TemporaryDirectory() as work_dir:
+        pipeline_dir = work_dir + "/pipeline"
+        generate_synthetic_pipeline(pipeline_dir, depth, breadth, 100, 10, environment_count, seed)
+        template_files = [
+            os.path.join(root, file_name)
+            for root, _, file_names in os.walk(pipeline_dir + "/templates")
+            for file_name in file_names
+            if file_name != "main.json"
+        ]
+        merge_command = [sys.executable, pypeline_script, "--folder", pipeline_dir, "merge", "--environment", "all"]
+
+        merge_times = []
+        for edit in range(edits):
+            edit_template(template_files, random_generator, edit)
+            start = time.perf_counter()
+            subprocess.run(merge_command, capture_output=True, check=True)
+            merge_times.append(time.perf_counter() - start)
+
+        socket_path = work_dir + "/serve.sock"
+        server = subprocess.Popen(
+            [sys.executable, pypeline_script, "--folder", pipeline_dir, "serve", "--socket", socket_path],
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+        )
+        try:
+            wait_for_socket(socket_path, server)
+            ## Each request after an edit finds the change, merges the environments it affects and answers
+            serve_times = []
+            for edit in range(edits):
+                edit_template(template_files, random_generator, edits + edit)
+                start = time.perf_counter()
+                request_rules(socket_path, "env0")
+                serve_times.append(time.perf_counter() - start)
+            unchanged_times = []
+            for _ in range(edits):
+                start = time.perf_counter()
+                served = request_rules(socket_path, "env0")
+                unchanged_times.append(time.perf_counter() - start)
+        finally:
+            server.terminate()
+            server.wait()
+
+        ## The served rules must match what merge writes
+        subprocess.run(merge_command, capture_output=True, check=True)
+        with open(pipeline_dir + "/dist/env0.json", "r") as f:
+            if f.read() != served:
+                click.secho("Served rules differ from merge output", fg="red")
+                sys.exit(1)
+
+    click.echo(f"Templates: {len(template_files) + 1}, environments: {environment_count}")
+    click.echo(f"merge --environment all after an edit: {statistics.median(merge_times) * 1000:>8.1f} ms")
+    click.echo(f"serve request after an edit:           {statistics.median(serve_times) * 1000:>8.1f} ms")
+    click.echo(f"serve request without changes:         {statistics.median(unchanged_times) * 1000:>8.1f} ms")
+    click.secho(
+        f"Speedup after an edit: {statistics.median(merge_times) / statistics.median(serve_times):.1f}x", fg="green"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+import json
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import click
+import requests
+from akamai.edgegrid import EdgeGridAuth
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ak.property import Property
+
+RESPONSE_BODY = json.dumps(
+    {"versions": {"items": [{"propertyName": "www.example.com", "propertyId": "prp_1", "propertyVersion": 1}]}}
+).encode()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    connect_delay = 0
+    response_delay = 0
+
+    def setup(self):
+        ## Simulate the round trip of establishing a new connection
+        time.sleep(self.connect_delay)
+        super().setup()
+
+    def respond(self):
+        ## Simulate API processing time
+        time.sleep(self.response_delay)
+        content_length = int(self.headers.get("content-length", 0))
+        if content_length:
+            self.rfile.read(content_length)
+        self.send_response(200)
+        self.send_header("content-type", "application/json")
+        self.send_header("content-length", str(len(RESPONSE_BODY)))
+        self.end_headers()
+        self.wfile.write(RESPONSE_BODY)
+
+    do_GET = respond
+    do_POST = respond
+    do_PUT = respond
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubServer(ThreadingHTTPServer):
+    ## Accept bursts of concurrent connections without refusing them
+    request_queue_size = 256
+
+
+def start_stub_server(work_dir, connect_delay, response_delay=0):
+    ## Self-signed certificate for 127.0.0.1, so the benchmark includes the TLS handshake
+    cert_file = work_dir + "/cert.pem"
+    key_file = work_dir + "/key.pem"
+    subprocess.run(
+        [
+            "openssl",
+            "req",
+            "-x509",
+            "-newkey",
+            "rsa:2048",
+            "-nodes",
+            "-days",
+            "1",
+            "-subj",
+            "/CN=127.0.0.1",
+            "-addext",
+            "subjectAltName=IP:127.0.0.1",
+            "-keyout",
+            key_file,
+            "-out",
+            cert_file,
+        ],
+        check=True,
+        capture_output=True,
+    )
+    StubHandler.connect_delay = connect_delay
+    StubHandler.response_delay = response_delay
+    server = StubServer(("127.0.0.1", 0), StubHandler)
+    context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+    context.load_cert_chain(cert_file, key_file)
+    ## Handshake in the handler threads rather than serially in the accept loop
+    server.socket = context.wrap_socket(server.socket, server_side=True, do_handshake_on_connect=False)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, cert_file
+
+
+def unpooled_request(client, body):
+    ## Previous Akamai.do behaviour: new session, new auth and a closed connection for every call
+    request_url = "https://" + client.get_host() + "/papi/v1/search/find-by-value"
+    headers = {"PAPI-Use-Prefixes": "false", "accept": "application/json", "connection": "close"}
+    with requests.Session() as session:
+        session.auth = EdgeGridAuth(
+            client_token=client.get_client_token(),
+            client_secret=client.get_client_secret(),
+            access_token=client.get_access_token(),
+        )
+        result = session.post(request_url, headers=headers, data=json.dumps(body))
+        return json.loads(result.content)
+
+
+@click.command()
+@click.option("--requests", "request_count", default=50, help="Number of requests per mode")
+@click.option("--connect-delay", default=0.0, help="Seconds added to every new connection to simulate network latency")
+def main(request_count, connect_delay):
+    """
+    Compare per-request latency of pooled sessions with a new session per request
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        server, cert_file = start_stub_server(work_dir, connect_delay)
+        os.environ["REQUESTS_CA_BUNDLE"] = cert_file
+        os.environ["AKAMAI_HOST"] = "127.0.0.1:%d" % server.server_address[1]
+        os.environ["AKAMAI_CLIENT_TOKEN"] = "akab-client-token"
+        os.environ["AKAMAI_ACCESS_TOKEN"] = "akab-access-token"
+        os.environ["AKAMAI_CLIENT_SECRET"] = "client-secret"
+        client = Property()
+
+        body = {"propertyName": "www.example.com"}
+        start = time.perf_counter()
+        for _ in range(request_count):
+            unpooled_request(client, body)
+        unpooled = (time.perf_counter() - start) / request_count
+
+        start = time.perf_counter()
+        for _ in range(request_count):
+            client.findProperty("www.example.com")
+        pooled = (time.perf_counter() - start) / request_count
+
+        server.shutdown()
+
+    click.echo(f"New session per request: {unpooled * 1000:.2f} ms/request")
+    click.echo(f"Pooled session:          {pooled * 1000:.2f} ms/request")
+    click.secho(f"Saving: {(unpooled - pooled) * 1000:.2f} ms/request", fg="green")
+
+
+if __name__ == "__main__":
+    main()
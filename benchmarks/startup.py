@@ -0,0 +1,106 @@
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+import time
+import click
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO_PIPELINE = REPO_DIR + "/example/demopipeline"
+
+## Placeholder credentials, so trees which still create the PAPI client at startup can run local commands too
+CREDENTIALS = {
+    "AKAMAI_HOST": "akab-host.luna.akamaiapis.net",
+    "AKAMAI_CLIENT_TOKEN": "akab-client-token",
+    "AKAMAI_ACCESS_TOKEN": "akab-access-token",
+    "AKAMAI_CLIENT_SECRET": "client-secret",
+}
+
+
+def get_commands(pipeline_dir):
+    return {
+        "--help": ["--help"],
+        "merge --help": ["merge", "--help"],
+        "merge": ["--folder", pipeline_dir, "merge", "--environment", "dev"],
+    }
+
+
+def export_tree(ref, work_dir):
+    ## Extract a committed tree to compare against, without touching the working copy
+    tree_dir = work_dir + "/" + ref.replace("/", "_")
+    archive = subprocess.run(["git", "archive", ref], cwd=REPO_DIR, capture_output=True, check=True).stdout
+    with tempfile.TemporaryFile() as f:
+        f.write(archive)
+        f.seek(0)
+        with tarfile.open(fileobj=f) as tar:
+            tar.extractall(tree_dir)
+    return tree_dir
+
+
+def time_command(tree_dir, arguments, environment, repeat):
+    command = [sys.executable, tree_dir + "/pypeline.py"] + arguments
+    ## The first run writes bytecode caches, as an installed copy would already have them
+    subprocess.run(command, env=environment, capture_output=True, check=True)
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(command, env=environment, capture_output=True, check=True)
+        times.append(time.perf_counter() - start)
+    return min(times), statistics.median(times)
+
+
+@click.command()
+@click.option("--repeat", default=20, help="Number of timed runs per command")
+@click.option("--baseline", default=None, help="Git ref to compare against, e.g. HEAD~1")
+@click.option("--with-credentials", is_flag=True, default=False, help="Set placeholder credentials for every tree")
+def main(repeat, baseline, with_credentials):
+    """
+    Time how long the CLI takes to start for commands which don't call PAPI, as pre-commit hooks running merge do
+    """
+    with tempfile.TemporaryDirectory() as work_dir:
+        pipeline_dir = work_dir + "/pipeline"
+        shutil.copytree(DEMO_PIPELINE, pipeline_dir)
+        ## An empty home directory, so no .edgerc or caches are found
+        home_dir = work_dir + "/home"
+        os.makedirs(home_dir)
+        environment = {
+            key: value
+            for key, value in os.environ.items()
+            if not key.startswith("AKAMAI_") and key != "PYTHONDONTWRITEBYTECODE"
+        }
+        environment["HOME"] = home_dir
+
+        trees = {"working copy": REPO_DIR}
+        if baseline is not None:
+            trees[baseline] = export_tree(baseline, work_dir)
+            ## Older trees need credentials even for local commands
+            with_credentials = True
+        if with_credentials:
+            environment.update(CREDENTIALS)
+
+        results = {}
+        for name, tree_dir in trees.items():
+            for command_name, arguments in get_commands(pipeline_dir).items():
+                try:
+                    results.setdefault(command_name, {})[name] = time_command(tree_dir, arguments, environment, repeat)
+                except subprocess.CalledProcessError as err:
+                    click.secho(f"{name}: '{command_name}' failed: {err.stderr.decode().strip()}", fg="red")
+                    sys.exit(1)
+
+    click.echo(f"{'Command':<16}" + "".join(f"{name:>24}" for name in trees))
+    for command_name, times in results.items():
+        click.echo(
+            f"{command_name:<16}"
+            + "".join(f"{'%.0f ms (median %.0f)' % (low * 1000, median * 1000):>24}" for low, median in times.values())
+        )
+    if baseline is not None:
+        for command_name, times in results.items():
+            speedup = times[baseline][1] / times["working copy"][1]
+            click.secho(f"{command_name}: {speedup:.1f}x faster than {baseline}", fg="green")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,132 @@
+import contextlib
+import json
+import os
+import re
+import threading
+import time
+import click
+
+## Spans are only recorded once enabled by --profile or --debug
+ENABLED = False
+LOG_SPANS = False
+SPANS = []
+SPANS_LOCK = threading.Lock()
+START = time.perf_counter()
+
+## Property, version and activation ids are replaced so requests to the same endpoint are summarised together
+PAPI_ID_MATCH = re.compile(r"/(?:[a-z]{3}_)?\d+(?=/|$)")
+
+
+def enable(log_spans=False):
+    global ENABLED
+    global LOG_SPANS
+    ENABLED = True
+    LOG_SPANS = log_spans
+
+
+def record(name, start, duration, **attributes):
+    if not ENABLED:
+        return
+    span = {
+        "name": name,
+        "start": start - START,
+        "duration": duration,
+        "thread": threading.get_ident(),
+        "attributes": attributes,
+    }
+    with SPANS_LOCK:
+        SPANS.append(span)
+    if LOG_SPANS:
+        details = " ".join(f"{key}={value}" for key, value in attributes.items())
+        click.secho(f"[debug] {name}: {duration * 1000:.1f} ms {details}".rstrip(), fg="bright_black", err=True)
+
+
+@contextlib.contextmanager
+def span(name, **attributes):
+    ## Attributes can be added to the yielded dict before the span ends
+    if not ENABLED:
+        yield attributes
+        return
+    start = time.perf_counter()
+    try:
+        yield attributes
+    finally:
+        record(name, start, time.perf_counter() - start, **attributes)
+
+
+def record_request(method, path, status, size, start, duration):
+    ## Request hook for ak.base.Akamai clients
+    name = "PAPI " + method + " " + PAPI_ID_MATCH.sub("/{id}", path)
+    record(name, start, duration, path=path, status=status, bytes=size)
+
+
+def summarise():
+    ## Count, total and longest duration of each span name, in the order they first started
+    summary = {}
+    with SPANS_LOCK:
+        spans = sorted(SPANS, key=lambda s: s["start"])
+    for span in spans:
+        entry = summary.setdefault(span["name"], {"count": 0, "total": 0, "max": 0, "bytes": 0, "statuses": []})
+        entry["count"] += 1
+        entry["total"] += span["duration"]
+        entry["max"] = max(entry["max"], span["duration"])
+        entry["bytes"] += span["attributes"].get("bytes") or 0
+        if "status" in span["attributes"] and str(span["attributes"]["status"]) not in entry["statuses"]:
+            entry["statuses"].append(str(span["attributes"]["status"]))
+    return summary
+
+
+def format_table():
+    summary = summarise()
+    width = max([len(name) for name in summary] + [4])
+    lines = [f"{'Span':<{width}}  {'Count':>5}  {'Total ms':>10}  {'Mean ms':>9}  {'Max ms':>9}  {'KB':>8}  Status"]
+    for name, entry in summary.items():
+        lines.append(
+            f"{name:<{width}}  {entry['count']:>5}  {entry['total'] * 1000:>10.1f}  "
+            f"{entry['total'] / entry['count'] * 1000:>9.1f}  {entry['max'] * 1000:>9.1f}  {entry['bytes'] / 1024:>8.1f}  "
+            f"{','.join(entry['statuses'])}".rstrip()
+        )
+
+    ## Requests may run concurrently, so their total can exceed the elapsed time
+    requests = [entry for name, entry in summary.items() if name.startswith("PAPI ")]
+    lines.append(f"Elapsed: {(time.perf_counter() - START) * 1000:.1f} ms")
+    lines.append(
+        f"PAPI requests: {sum(e['count'] for e in requests)}, "
+        f"{sum(e['total'] for e in requests) * 1000:.1f} ms, {sum(e['bytes'] for e in requests) / 1024:.1f} KB"
+    )
+    return "\n".join(lines)
+
+
+def format_json():
+    with SPANS_LOCK:
+        spans = list(SPANS)
+    return json.dumps({"spans": spans}, indent=2)
+
+
+def format_chrome_trace():
+    ## Complete events in the Trace Event format, viewable in chrome://tracing or Perfetto
+    with SPANS_LOCK:
+        spans = list(SPANS)
+    events = [
+        {
+            "name": span["name"],
+            "ph": "X",
+            "ts": span["start"] * 1000000,
+            "dur": span["duration"] * 1000000,
+            "pid": os.getpid(),
+            "tid": span["thread"],
+            "args": span["attributes"],
+        }
+        for span in spans
+    ]
+    return json.dumps({"traceEvents": events, "displayTimeUnit": "ms"})
+
+
+def write_report(profile_format, output_file=None):
+    report = {"table": format_table, "json": format_json, "chrome": format_chrome_trace}[profile_format]()
+    if output_file is None:
+        click.echo(report, err=True)
+    else:
+        with open(output_file, "w") as f:
+            f.write(report)
+        click.echo(f"Wrote profile to: {output_file}", err=True)
@@ -1,14 +1,39 @@
+import cProfile
+import functools
 import json
 import click
 import os
 import shutil
 import sys
 import re
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from ak.property import Property
+from ak import jsonbackend
 
 global LOG_LEVEL
 
+BUILD_MANIFEST_VERSION = 2
+
+## The PAPI client is only created once a command needs it, so local commands work without credentials
+PROPERTY_CLIENT = None
+PROPERTY_CLIENT_OPTIONS = {}
+PROPERTY_CLIENT_LOCK = threading.Lock()
+
+## Property name -> id/contract/group lookups, cached on disk between runs and in memory for this run
+PROPERTY_CACHE_FILE = os.path.expanduser("~/.cache/pypeline/properties.json")
+PROPERTY_CACHE = None
+PROPERTY_CACHE_LOCK = threading.Lock()
+PROPERTY_CACHE_TTL = 86400
+SEARCH_CACHE_FILE = os.path.expanduser("~/.cache/pypeline/searches.json")
+
+ACTIVATION_SUCCESS_STATUSES = ["ACTIVE"]
+ACTIVATION_FAILURE_STATUSES = ["FAILED", "ABORTED", "CANCELLED", "DEACTIVATED", "INACTIVE"]
+ACTIVATIONLINK_MATCH = ".*/activations/([^?/]+)"
+SCOPE_MATCH = re.compile("pypeline_env:([^;]+)")
+
+import profiling
 import utilities
 
 
@@ -16,8 +41,8 @@ def get_config(folder):
     # Load Config
     CONFIG_FILE = folder + "/pipeline.json"
     if os.path.exists(CONFIG_FILE):
-        with open(CONFIG_FILE, "r") as f:
-            return json.load(f)
+        with profiling.span("load config"), open(CONFIG_FILE, "r") as f:
+            return jsonbackend.load(f)
     else:
         click.secho(
             f"pipeline.json does not exist at '{folder}'. Please confirm location or use --name parameter to specify another folder",
@@ -30,7 +55,7 @@ def get_variable_definitions(folder):
     variable_definitions_file = folder + "/variableDefinitions.json"
     if os.path.exists(variable_definitions_file):
         with open(variable_definitions_file, "r") as f:
-            VARIABLE_DEFINITIONS = json.load(f)
+            VARIABLE_DEFINITIONS = jsonbackend.load(f)
     else:
         click.secho(f"Variable definitions not found at: {variable_definitions_file} . Cannot proceed", fg="red")
         sys.exit(1)
@@ -52,21 +77,176 @@ def get_environment(environment_name, CONFIG):
     return environment
 
 
-def get_property(property_name):
-    property_instances = PROPERTY_CLIENT.findProperty(property_name)
+def get_environments(environment_names, CONFIG):
+    ## Resolve 'all' or a comma-separated list of environment names against the pipeline config
+    if environment_names == "all":
+        return CONFIG["environments"]
+    return [get_environment(name, CONFIG) for name in environment_names.replace(", ", ",").split(",")]
+
+
+def get_property_client():
+    global PROPERTY_CLIENT
+    with PROPERTY_CLIENT_LOCK:
+        if PROPERTY_CLIENT is None:
+            ## Imported here as requests and edgegrid take most of the CLI's start up time
+            from ak.property import Property
+
+            PROPERTY_CLIENT = Property(**PROPERTY_CLIENT_OPTIONS)
+            PROPERTY_CLIENT.request_hook = profiling.record_request
+    return PROPERTY_CLIENT
+
+
+def get_property_cache_key(property_name):
+    ## Property names are only unique within an account, so key on API host and account switch key too
+    client = get_property_client()
+    return f"{client.get_host()}|{client.get_account_key()}|{property_name}"
+
+
+def get_cached_property(property_name):
+    global PROPERTY_CACHE
+    if PROPERTY_CACHE_TTL <= 0:
+        return None
+    with PROPERTY_CACHE_LOCK:
+        if PROPERTY_CACHE is None:
+            PROPERTY_CACHE = {}
+            if os.path.exists(PROPERTY_CACHE_FILE):
+                try:
+                    with open(PROPERTY_CACHE_FILE, "r") as f:
+                        PROPERTY_CACHE = json.load(f)
+                except ValueError:
+                    pass
+        cached_property = PROPERTY_CACHE.get(get_property_cache_key(property_name))
+    if cached_property is None or time.time() - cached_property["cachedAt"] > PROPERTY_CACHE_TTL:
+        return None
+    return cached_property
+
+
+def set_cached_property(property_name, property):
+    if PROPERTY_CACHE_TTL <= 0:
+        return
+    with PROPERTY_CACHE_LOCK:
+        cache_key = get_property_cache_key(property_name)
+        if property is None:
+            PROPERTY_CACHE.pop(cache_key, None)
+        else:
+            PROPERTY_CACHE[cache_key] = {
+                "propertyId": property["propertyId"],
+                "contractId": property.get("contractId"),
+                "groupId": property.get("groupId"),
+                "cachedAt": time.time(),
+            }
+        os.makedirs(os.path.dirname(PROPERTY_CACHE_FILE), exist_ok=True)
+        with open(PROPERTY_CACHE_FILE + ".tmp", "w") as f:
+            json.dump(PROPERTY_CACHE, f, indent=2)
+        os.replace(PROPERTY_CACHE_FILE + ".tmp", PROPERTY_CACHE_FILE)
+
+
+def get_search_cache_key(search_body):
+    client = get_property_client()
+    return f"{client.get_host()}|{client.get_account_key()}|{json.dumps(search_body, sort_keys=True)}"
+
+
+def get_cached_search(search_body, max_age):
+    ## Returns the cached results and when they were cached, or None if there are none younger than max_age seconds
+    if max_age <= 0 or not os.path.exists(SEARCH_CACHE_FILE):
+        return None
+    try:
+        with open(SEARCH_CACHE_FILE, "r") as f:
+            cached_search = json.load(f).get(get_search_cache_key(search_body))
+    except ValueError:
+        return None
+    if cached_search is None or time.time() - cached_search["cachedAt"] > max_age:
+        return None
+    return cached_search
+
+
+def set_cached_search(search_body, results, max_age):
+    ## Searches older than --cache-ttl, or max_age if longer, are dropped, so the cache doesn't grow without bound
+    search_cache = {}
+    if os.path.exists(SEARCH_CACHE_FILE):
+        try:
+            with open(SEARCH_CACHE_FILE, "r") as f:
+                search_cache = json.load(f)
+        except ValueError:
+            pass
+    now = time.time()
+    expiry_age = max(PROPERTY_CACHE_TTL, max_age)
+    search_cache = {key: entry for key, entry in search_cache.items() if now - entry["cachedAt"] <= expiry_age}
+    search_cache[get_search_cache_key(search_body)] = {"results": results, "cachedAt": now}
+    os.makedirs(os.path.dirname(SEARCH_CACHE_FILE), exist_ok=True)
+    with open(SEARCH_CACHE_FILE + ".tmp", "w") as f:
+        json.dump(search_cache, f, indent=2)
+    os.replace(SEARCH_CACHE_FILE + ".tmp", SEARCH_CACHE_FILE)
+
+
+def find_property(property_name):
+    ## Known property ids can be looked up directly, avoiding a search of every version of every property
+    cached_property = get_cached_property(property_name)
+    if cached_property is not None:
+        try:
+            property = get_property_client().getProperty(
+                cached_property["propertyId"], cached_property["contractId"], cached_property["groupId"]
+            )
+        except Exception:
+            property = None
+        if property is not None and property["propertyName"] == property_name:
+            ## Only the version knows whether it is pending, active or was deactivated, and so can't be changed
+            try:
+                latest_version = get_property_client().getPropertyVersion(
+                    property["propertyId"], property["latestVersion"], property["contractId"], property["groupId"]
+                )
+            except Exception:
+                latest_version = None
+            if latest_version is not None:
+                return dict(property, **latest_version)
+        ## Property has been renamed or removed since it was cached, or its latest version could not be read
+        set_cached_property(property_name, None)
+
+    property_instances = get_property_client().findProperty(property_name)
     if len(property_instances) == 0:
-        click.secho(f"Failed to find property: '{property_name}' . Can't proceed, sorry", fg="red")
-        sys.exit(1)
+        return None
     property_instances = sorted(property_instances, key=lambda p: int(p["propertyVersion"]), reverse=True)
+    set_cached_property(property_name, property_instances[0])
     return property_instances[0]
 
 
+def get_property(property_name):
+    property = find_property(property_name)
+    if property is None:
+        click.secho(f"Failed to find property: '{property_name}' . Can't proceed, sorry", fg="red")
+        sys.exit(1)
+    return property
+
+
+def get_environment_statuses(environments, concurrency):
+    ## Look up each environment's property on a bounded thread pool, yielding results in config order
+    def get_environment_status(environment):
+        environment_status = {"environment": environment["name"], "propertyName": environment["propertyName"]}
+        try:
+            property = find_property(environment["propertyName"])
+        except Exception as err:
+            environment_status["error"] = str(err)
+            return environment_status
+
+        if property is None:
+            environment_status["error"] = f"Failed to find property: '{environment['propertyName']}'"
+            return environment_status
+
+        for field in ["propertyName", "propertyId", "propertyVersion", "note", "stagingStatus", "productionStatus"]:
+            if field in property.keys():
+                environment_status[field] = property[field]
+        return environment_status
+
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        yield from executor.map(get_environment_status, environments)
+
+
 def get_hostnames(folder, environment_name):
     ## Env-specific variables
     hostnames_file = folder + "/environments/" + environment_name + "/hostnames.json"
     if os.path.exists(hostnames_file):
-        with open(hostnames_file, "r") as f:
-            HOSTNAMES = json.load(f)
+        with profiling.span("load hostnames", environment=environment_name), open(hostnames_file, "r") as f:
+            HOSTNAMES = jsonbackend.load(f)
     else:
         click.secho(f"Hostnames variables file not found at: {hostnames_file} . Cannot proceed", fg="red")
         sys.exit(1)
@@ -74,24 +254,22 @@ def get_hostnames(folder, environment_name):
     return HOSTNAMES
 
 
-def merge_pipeline(folder, environment_name):
+def get_variable_values(folder, environment_name):
     ## Get variable defs
     VARIABLE_DEFINITIONS = get_variable_definitions(folder)
 
     ## Env-specific variables
     env_variables_file = folder + "/environments/" + environment_name + "/variables.json"
     if os.path.exists(env_variables_file):
-        with open(env_variables_file, "r") as f:
-            ENV_VARIABLES = json.load(f)
+        with profiling.span("load variables", environment=environment_name), open(env_variables_file, "r") as f:
+            ENV_VARIABLES = jsonbackend.load(f)
     else:
         click.secho(f"Environment variables file not found at: {env_variables_file} . Cannot proceed", fg="red")
         sys.exit(1)
 
-    ## Load templates to dict
-    main_file = folder + "/templates/main.json"
-    rules = utilities.merge_rules(main_file)
-
-    ## Interpolate variables
+    ## Split variables into those applied by jsonPath and those interpolated by name
+    positional_variables = []
+    value_variables = {}
     for variable in VARIABLE_DEFINITIONS:
         if variable["name"] in ENV_VARIABLES.keys():
             env_variable_value = ENV_VARIABLES[variable["name"]]
@@ -100,50 +278,504 @@ def merge_pipeline(folder, environment_name):
 
         if "jsonPaths" in variable.keys():
             for path in variable["jsonPaths"]:
-                utilities.apply_variable_by_jsonpath(rules, path, env_variable_value)
+                positional_variables.append((path, env_variable_value))
         else:
-            ## Cast rules to string, replace globally and cast back to dict
-            rules_str = json.dumps(rules)
-            if isinstance(env_variable_value, bool):
-                rules_str = rules_str.replace('"${env.%s}"' % variable["name"], json.dumps(env_variable_value))
-            elif isinstance(env_variable_value, int):
-                rules_str = rules_str.replace('"${env.%s}"' % variable["name"], str(env_variable_value))
-            else:
-                rules_str = rules_str.replace("${env.%s}" % variable["name"], env_variable_value)
-            rules = json.loads(rules_str)
+            value_variables[variable["name"]] = env_variable_value
+
+    return positional_variables, value_variables
+
+
+def merge_pipeline(folder, environment_name, templates=None, rule_scopes=None):
+    positional_variables, value_variables = get_variable_values(folder, environment_name)
+
+    ## Load templates to dict, unless they have already been loaded for another environment.
+    ## Includes scoped out of this environment are not loaded, along with any jsonPath variables inside them
+    if templates is None:
+        main_file = folder + "/templates/main.json"
+        template_index = get_template_index(folder)
+        indexed_templates = dict(template_index["templates"])
+        skip_include, skipped_keys = get_include_filter(
+            environment_name, os.path.dirname(main_file), positional_variables, value_variables, template_index
+        )
+        with profiling.span("merge templates", environment=environment_name) as span:
+            rules = utilities.merge_rules(main_file, skip_include=skip_include)
+            span["skipped_includes"] = len(skipped_keys)
+        if template_index["templates"] != indexed_templates:
+            save_template_index(folder, template_index)
+        positional_variables = [(p, v) for p, v in positional_variables if not in_skipped_rule(p, skipped_keys)]
+    else:
+        rules = utilities.copy_json(templates)
+
+    ## Compiled scopes can't be trusted if jsonPath variables might change comments or replace rules
+    if rule_scopes is not None and any(changes_rule_scopes(path) for path, _ in positional_variables):
+        rule_scopes = None
+
+    ## Apply all positional variables together, so shared path prefixes are only traversed once
+    with profiling.span("apply jsonPath variables", environment=environment_name, variables=len(positional_variables)):
+        utilities.apply_variables_by_jsonpath(rules, positional_variables)
+
+    ## Replace all value variables in a single pass over the rule tree
+    with profiling.span("interpolate variables", environment=environment_name, variables=len(value_variables)):
+        rules = utilities.interpolate_variables(rules, value_variables)
 
     ## Remove out of scope rules
-    rules["rules"] = remove_out_of_scope_rules(rules["rules"], environment_name)
+    with profiling.span("scope rules", environment=environment_name):
+        rules["rules"] = remove_out_of_scope_rules(rules["rules"], environment_name, rule_scopes)
 
     return rules
 
 
-def remove_out_of_scope_rules(rules, environment_name):
-    # Search rule comments for pypeline_env, and remove any rule referencing an env other than the current one
-    if "children" in rules.keys():
-        parsed_children = []
-        for child in rules["children"]:
-            if "comments" in child.keys():
-                scoped_environments_found = re.search("pypeline_env:([^;]+)", child["comments"])
-                # Parse comments. If environment name in pypeline_env include child in output
-                if scoped_environments_found is not None:
-                    scoped_environments = scoped_environments_found.group(1).replace(" ", "")
-                    scoped_environments = scoped_environments.split(",")
-                    if environment_name in scoped_environments:
-                        parsed_children.append(child)
-                # If no pypeline_env comment, include child by default
+def set_worker_templates(templates, rule_scopes):
+    ## Runs once in each merge worker process, so the template tree is only sent to each worker once
+    global WORKER_TEMPLATES
+    global WORKER_RULE_SCOPES
+    WORKER_TEMPLATES = templates
+    WORKER_RULE_SCOPES = rule_scopes
+
+
+def merge_worker_pipeline(folder, environment_name):
+    return merge_pipeline(folder, environment_name, WORKER_TEMPLATES, WORKER_RULE_SCOPES)
+
+
+def merge_pipelines(folder, environment_names, processes=None, templates=None, start_method=None):
+    ## Load templates and includes once, then interpolate each environment in a pool of worker processes.
+    ## Pass a start_method such as forkserver when other threads may hold locks, which forked workers would inherit
+    if templates is None:
+        main_file = folder + "/templates/main.json"
+        with profiling.span("merge templates"):
+            templates = utilities.merge_rules(main_file)
+
+    ## Parse pypeline_env comments once for every environment, rather than in each worker
+    with profiling.span("compile scopes"):
+        rule_scopes = compile_rule_scopes(templates["rules"])
+
+    ## Imported here as multiprocessing is slow to import, and only needed for several environments
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    mp_context = None
+    if start_method is not None and start_method in multiprocessing.get_all_start_methods():
+        mp_context = multiprocessing.get_context(start_method)
+
+    results = {}
+    with ProcessPoolExecutor(
+        max_workers=processes,
+        mp_context=mp_context,
+        initializer=set_worker_templates,
+        initargs=(templates, rule_scopes),
+    ) as executor:
+        futures = {name: executor.submit(merge_worker_pipeline, folder, name) for name in environment_names}
+        for name, future in futures.items():
+            try:
+                results[name] = future.result()
+            except (Exception, SystemExit) as err:
+                results[name] = err
+    return results
+
+
+def get_build_manifest(folder):
+    ## The build manifest records the fingerprint of every input to each environment's dist output
+    manifest_file = folder + "/dist/.build/manifest.json"
+    if os.path.exists(manifest_file):
+        with open(manifest_file, "r") as f:
+            manifest = jsonbackend.load(f)
+        if manifest.get("version") == BUILD_MANIFEST_VERSION:
+            return manifest
+    return {"version": BUILD_MANIFEST_VERSION, "environments": {}}
+
+
+def save_build_manifest(folder, manifest):
+    build_folder = folder + "/dist/.build"
+    os.makedirs(build_folder, exist_ok=True)
+    with open(build_folder + "/manifest.json", "w") as f:
+        jsonbackend.dump(manifest, f, indent=2)
+
+
+def get_environment_input_files(folder, environment_name):
+    return [folder + "/variableDefinitions.json", folder + "/environments/" + environment_name + "/variables.json"]
+
+
+def build_up_to_date(folder, environment_name, manifest, indent):
+    ## An environment is up to date if its dist file was written with the same indent,
+    ## and it and every template and variable file are unchanged
+    build = manifest["environments"].get(environment_name)
+    if build is None or build["indent"] != indent:
+        return False
+    return (
+        utilities.fingerprints_unchanged(folder, build["output"])
+        and utilities.fingerprints_unchanged(folder, build["inputs"])
+        and utilities.fingerprints_unchanged(folder, build["templates"])
+    )
+
+
+def load_build_templates(folder):
+    ## Reuse the merged template tree from the last build if none of its files have changed since
+    templates_file = folder + "/dist/.build/templates.json"
+    if os.path.exists(templates_file):
+        build_templates = jsonbackend.read(templates_file)
+        if utilities.fingerprints_unchanged(folder, build_templates["templates"]):
+            return build_templates["rules"], build_templates["templates"]
+
+    main_file = folder + "/templates/main.json"
+    loaded_files = []
+    with profiling.span("merge templates"):
+        templates = utilities.merge_rules(main_file, loaded_files)
+    template_fingerprints = dict(utilities.file_fingerprint(folder, f) for f in loaded_files)
+
+    os.makedirs(folder + "/dist/.build", exist_ok=True)
+    with open(templates_file, "w") as f:
+        jsonbackend.dump({"templates": template_fingerprints, "rules": templates}, f)
+    return templates, template_fingerprints
+
+
+def record_build(folder, environment_name, manifest, template_fingerprints, indent):
+    dist_file = folder + "/dist/" + environment_name + ".json"
+    manifest["environments"][environment_name] = {
+        "indent": indent,
+        "templates": template_fingerprints,
+        "inputs": dict(
+            utilities.file_fingerprint(folder, f) for f in get_environment_input_files(folder, environment_name)
+        ),
+        "output": dict([utilities.file_fingerprint(folder, dist_file)]),
+    }
+
+
+def get_template_index(folder):
+    ## The template index records each template's name, comments and includes, so scoped out includes can be skipped unread
+    index_file = folder + "/dist/.build/template-index.json"
+    if os.path.exists(index_file):
+        with open(index_file, "r") as f:
+            template_index = jsonbackend.load(f)
+        if template_index.get("version") == BUILD_MANIFEST_VERSION:
+            return template_index
+    return {"version": BUILD_MANIFEST_VERSION, "templates": {}}
+
+
+def save_template_index(folder, template_index):
+    ## Only kept with the build metadata of incremental merges, so other merges and updates leave no build files behind
+    build_folder = folder + "/dist/.build"
+    if not os.path.isdir(build_folder):
+        return
+    with open(build_folder + "/template-index.json", "w") as f:
+        jsonbackend.dump(template_index, f, indent=2)
+
+
+def get_include_filter(
+    environment_name, main_dir, positional_variables, value_variables, template_index, cache_templates=True
+):
+    ## Returns a skip_include function for utilities.merge_rules, and a list of the rule keys it skipped.
+    ## Includes are never skipped if a jsonPath variable could match anywhere in the rule tree
+    positional_keys = [utilities.get_simple_jsonpath_keys(path) for path, value in positional_variables]
+    skipped_keys = []
+    if None in positional_keys:
+        return None, skipped_keys
+
+    def skip_include(file_path, file_stat, rule_keys):
+        # Positional variables could replace the rule or its comments, changing its scope
+        if any(keys in (rule_keys, rule_keys + ("comments",)) for keys in positional_keys):
+            return None
+        summary = utilities.get_template_summary(
+            file_path, main_dir, file_stat, template_index["templates"], cache_templates
+        )
+        comments = summary["comments"]
+        if isinstance(comments, str):
+            comments = utilities.interpolate_string(comments, value_variables)
+        if not isinstance(comments, str) or rule_in_scope({"comments": comments}, environment_name):
+            return None
+        skipped_keys.append(rule_keys)
+        # The placeholder keeps the position of later rules for jsonPath variables, and is removed when scoping
+        return {"name": summary["name"], "comments": summary["comments"]}
+
+    return skip_include, skipped_keys
+
+
+def in_skipped_rule(path, skipped_keys):
+    keys = utilities.get_simple_jsonpath_keys(path)
+    return any(keys[: len(rule_keys)] == rule_keys for rule_keys in skipped_keys)
+
+
+def report_results(results):
+    ## Summarise per-environment outcomes, returning True if every environment succeeded
+    click.echo("-----------------------------------------")
+    succeeded = True
+    for name, result in results.items():
+        if isinstance(result, SystemExit):
+            click.secho(f"{name}: failed", fg="red")
+            succeeded = False
+        elif isinstance(result, Exception):
+            click.secho(f"{name}: failed ({result})", fg="red")
+            succeeded = False
+        else:
+            click.secho(f"{name}: succeeded", fg="green")
+    return succeeded
+
+
+def render_activations(activations, redraw):
+    ## On a terminal redraw the status table in place, otherwise log each status change as it happens
+    if sys.stdout.isatty():
+        if redraw:
+            click.echo(f"\x1b[{len(activations)}F", nl=False)
+        for activation in activations:
+            click.echo("\x1b[2K", nl=False)
+            click.secho(
+                f"{activation['environment']}: version {activation['propertyVersion']} of {activation['propertyName']} "
+                f"on {activation['network']} is {activation['status']}",
+                fg=get_activation_colour(activation["status"]),
+            )
+        return
+
+    for activation in activations:
+        if activation.get("reportedStatus") != activation["status"]:
+            now = datetime.now().strftime("%H:%M:%S")
+            click.secho(
+                f"[{now}] {activation['environment']}: version {activation['propertyVersion']} of "
+                f"{activation['propertyName']} on {activation['network']} is {activation['status']}",
+                fg=get_activation_colour(activation["status"]),
+            )
+            activation["reportedStatus"] = activation["status"]
+
+
+def get_activation_colour(status):
+    if status in ACTIVATION_SUCCESS_STATUSES:
+        return "green"
+    elif status in ACTIVATION_FAILURE_STATUSES:
+        return "red"
+    return "yellow"
+
+
+def watch_activations(activations, interval, max_interval, timeout=None, concurrency=10):
+    ## Poll activations until each has finished. Returns 0 if all are ACTIVE, 1 if any failed and 2 on timeout
+    finished_statuses = ACTIVATION_SUCCESS_STATUSES + ACTIVATION_FAILURE_STATUSES
+    started = time.monotonic()
+    deadline = None if timeout is None else started + timeout
+    for activation in activations:
+        activation["interval"] = interval
+        activation["nextPoll"] = started
+
+    def poll_activation(activation):
+        try:
+            return get_property_client().getActivation(activation["propertyId"], activation["activationId"])["status"]
+        except Exception:
+            ## Transient failures are retried at the next poll
+            return activation["status"]
+
+    render_activations(activations, redraw=False)
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        while True:
+            pending = [a for a in activations if a["status"] not in finished_statuses]
+            if len(pending) == 0:
+                break
+            if deadline is not None and time.monotonic() >= deadline:
+                click.secho(f"Timed out after {timeout} seconds waiting for activations", fg="red")
+                return 2
+
+            ## Never wait past the timeout for the next poll
+            wake_at = min(a["nextPoll"] for a in pending)
+            if deadline is not None:
+                wake_at = min(wake_at, deadline)
+            time.sleep(max(0, wake_at - time.monotonic()))
+            due = [a for a in pending if a["nextPoll"] <= time.monotonic()]
+
+            ## Back off while an activation's status is unchanged, and poll sooner again once it moves
+            for activation, status in zip(due, executor.map(poll_activation, due)):
+                if status == activation["status"]:
+                    activation["interval"] = min(activation["interval"] * 1.5, max_interval)
                 else:
-                    parsed_children.append(child)
-            # If no comments at all, include child by default
+                    activation["interval"] = interval
+                    activation["status"] = status
+                activation["nextPoll"] = time.monotonic() + activation["interval"]
+            render_activations(activations, redraw=True)
+
+    if any(a["status"] in ACTIVATION_FAILURE_STATUSES for a in activations):
+        return 1
+    return 0
+
+
+@functools.lru_cache(maxsize=None)
+def get_scoped_environments(comments):
+    ## Environments listed in a pypeline_env comment, or None if the rule isn't scoped
+    scoped_environments_found = SCOPE_MATCH.search(comments)
+    if scoped_environments_found is None:
+        return None
+    return frozenset(scoped_environments_found.group(1).replace(" ", "").split(","))
+
+
+def rule_in_scope(rule, environment_name):
+    # Parse comments. If a pypeline_env comment exists, only include the rule for the environments listed
+    comments = rule.get("comments")
+    if isinstance(comments, str):
+        scoped_environments = get_scoped_environments(comments)
+        if scoped_environments is not None:
+            return environment_name in scoped_environments
+    # If no comments or no pypeline_env comment, include rule by default
+    return True
+
+
+def compile_rule_scopes(rules):
+    ## Map the index of each child which may be scoped, or has scoped descendants, to the scopes of its own children.
+    ## Comments containing variables count as scoped, as they can only be parsed once interpolated
+    rule_scopes = {}
+    for index, child in enumerate(rules.get("children", [])):
+        child_scopes = compile_rule_scopes(child)
+        comments = child.get("comments")
+        if child_scopes or (
+            isinstance(comments, str) and ("${env." in comments or get_scoped_environments(comments) is not None)
+        ):
+            rule_scopes[index] = child_scopes
+    return rule_scopes
+
+
+def changes_rule_scopes(path):
+    ## Whether a jsonPath variable could set a rule's comments or replace rules, moving them out of line with
+    ## compiled scopes. Values set within behaviors, criteria and variables never can
+    keys = utilities.get_simple_jsonpath_keys(path)
+    if keys is None:
+        return True
+    if any(key in ("behaviors", "criteria", "variables") for key in keys):
+        return False
+    return keys[-1] in ("rules", "comments", "children") or isinstance(keys[-1], int)
+
+
+def remove_out_of_scope_rules(rules, environment_name, rule_scopes=None):
+    # Search rule comments for pypeline_env, and remove any rule referencing an env other than the current one.
+    # With scopes from compile_rule_scopes only the children which may be scoped are visited
+    children = rules.get("children")
+    if not children:
+        return rules
+    if rule_scopes is None:
+        rules["children"] = [
+            remove_out_of_scope_rules(child, environment_name)
+            for child in children
+            if rule_in_scope(child, environment_name)
+        ]
+        return rules
+
+    out_of_scope = set()
+    for index, child_scopes in rule_scopes.items():
+        if rule_in_scope(children[index], environment_name):
+            remove_out_of_scope_rules(children[index], environment_name, child_scopes)
+        else:
+            out_of_scope.add(index)
+    if out_of_scope:
+        rules["children"] = [child for index, child in enumerate(children) if index not in out_of_scope]
+    return rules
+
+
+def apply_positional_variables(node, node_keys, positional_variables, applied):
+    ## Apply each simple jsonPath variable that falls within this template, stopping at includes not yet loaded
+    for position, (keys, value) in enumerate(positional_variables):
+        if position in applied or keys[: len(node_keys)] != node_keys:
+            continue
+        target = node
+        remaining_keys = keys[len(node_keys) :]
+        for depth, key in enumerate(remaining_keys):
+            if isinstance(target, str) and "#include:" in target:
+                ## Applied once the included template is loaded
+                break
+            if isinstance(key, str) and isinstance(target, dict) and key in target:
+                found = True
+            elif isinstance(key, int) and isinstance(target, list) and key < len(target):
+                found = True
+            else:
+                found = False
+            if not found:
+                break
+            if depth == len(remaining_keys) - 1:
+                target[key] = value
+                applied.add(position)
             else:
-                parsed_children.append(child)
+                target = target[key]
 
-        # Recurse through child rules
-        for parsed_child in parsed_children:
-            parsed_child = remove_out_of_scope_rules(parsed_child, environment_name)
-        # Replace children with parsed
-        rules["children"] = parsed_children
-    return rules
+
+def stream_pipeline(folder, environment_name, output_file, indent=2):
+    ## Merge, interpolate and scope each template as it is written, so only the current branch is held in memory.
+    ## Returns False without writing anything when a jsonPath variable needs the whole merged tree
+    positional_variables, value_variables = get_variable_values(folder, environment_name)
+    simple_positional_variables = []
+    for path, value in positional_variables:
+        keys = utilities.get_simple_jsonpath_keys(path)
+        if keys is None:
+            return False
+        simple_positional_variables.append((keys, value))
+    applied = set()
+
+    main_file = folder + "/templates/main.json"
+    main_dir = os.path.dirname(main_file)
+    template_index = get_template_index(folder)
+    indexed_templates = dict(template_index["templates"])
+    ## Templates aren't added to the template cache, which would otherwise come to hold the whole tree
+    skip_include, skipped_keys = get_include_filter(
+        environment_name, main_dir, positional_variables, value_variables, template_index, cache_templates=False
+    )
+
+    def prepare_rule(rule, rule_keys):
+        ## Positional variables are applied before value variables, matching merge_pipeline
+        apply_positional_variables(rule, rule_keys, simple_positional_variables, applied)
+        children = rule.get("children")
+        if "children" in rule:
+            rule["children"] = []
+        rule = utilities.interpolate_variables(rule, value_variables)
+        if children is not None:
+            rule["children"] = children
+        return rule
+
+    def load_child(child, parent_dir, rule_keys):
+        include_filename = child.replace("#include:", "")
+
+        # Check if child file is relative to parent folder, or to main json
+        child_path, child_stat = utilities.find_template(
+            parent_dir + "/" + include_filename, main_dir + "/" + include_filename
+        )
+        if child_path is None:
+            raise Exception(
+                f"File {include_filename} not found as either relative or full path from main. Please confirm file exists and try again."
+            )
+        if skip_include(child_path, child_stat, rule_keys) is not None:
+            return None
+        child = utilities.load_template(child_path, child_stat, cache=False)
+        return load_rule(child, os.path.dirname(child_path), rule_keys)
+
+    def load_rule(rule, rule_dir, rule_keys):
+        rule = prepare_rule(rule, rule_keys)
+        if "children" in rule:
+            rule["children"] = utilities.LazyList(iter_children(rule["children"], rule_dir, rule_keys))
+        return rule
+
+    def iter_children(children, parent_dir, parent_keys):
+        for index, child in enumerate(children):
+            child_keys = parent_keys + ("children", index)
+            if isinstance(child, str) and "#include:" in child:
+                child = load_child(child, parent_dir, child_keys)
+                if child is None:
+                    continue
+            elif isinstance(child, dict):
+                ## Inline rules are already complete, so can be scoped in full
+                apply_positional_variables(child, child_keys, simple_positional_variables, applied)
+                child = utilities.interpolate_variables(child, value_variables)
+                child = remove_out_of_scope_rules(child, environment_name)
+            else:
+                yield utilities.interpolate_variables(child, value_variables)
+                continue
+            if rule_in_scope(child, environment_name):
+                yield child
+
+    ## Children of main are relative to the templates folder, as is the variables include
+    main_rule = utilities.load_template(main_file, cache=False)
+    if isinstance(main_rule["variables"], str) and "#include:" in main_rule["variables"]:
+        variables_file = main_rule["variables"].replace("#include:", main_dir + "/")
+        main_rule["variables"] = utilities.load_template(variables_file, cache=False)
+    main_rule = prepare_rule(main_rule, ("rules",))
+    main_rule["children"] = utilities.LazyList(iter_children(main_rule["children"], main_dir, ("rules",)))
+
+    for chunk in utilities.iter_json({"rules": main_rule}, indent):
+        output_file.write(chunk)
+
+    if template_index["templates"] != indexed_templates:
+        save_template_index(folder, template_index)
+    for position, (path, value) in enumerate(positional_variables):
+        if position not in applied and not in_skipped_rule(path, skipped_keys):
+            click.secho(f"WARNING: Path '{path}' not found in supplied rules. No update performed", fg="yellow")
+    return True
 
 
 @click.group()
@@ -151,16 +783,100 @@ def remove_out_of_scope_rules(rules, environment_name):
 @click.option("--section", "-s", "section", default="default", help="Section in Edgerc file")
 @click.option("--account-key", "-a", "account_key", default=None, help="Account Switch Key")
 @click.option("--folder", "folder", type=click.Path(exists=True, dir_okay=True), default=".", help="Pipeline folder")
-@click.option("--debug", "-d", "debug_mode", is_flag=True, help="Add additional debug logging")
-def cli(edgerc_path, section, account_key, folder, debug_mode):
+@click.option(
+    "--debug", "-d", "debug_mode", is_flag=True, help="Log the timing of each stage and PAPI request as it completes"
+)
+@click.option(
+    "--pool-size", "pool_size", type=int, default=10, help="Maximum pooled keep-alive connections to the Akamai API"
+)
+@click.option(
+    "--cache-ttl",
+    "cache_ttl",
+    type=int,
+    default=86400,
+    help="Seconds to cache property name to id lookups for. Set to 0 to disable the cache",
+)
+@click.option("--connect-timeout", "connect_timeout", type=float, default=10, help="Seconds to wait for a connection")
+@click.option(
+    "--read-timeout", "read_timeout", type=float, default=120, help="Seconds to wait for each Akamai API response"
+)
+@click.option(
+    "--retries",
+    "retries",
+    type=int,
+    default=5,
+    help="Retries of rate limited, failed or timed out Akamai API requests, with exponential backoff",
+)
+@click.option(
+    "--rate-limit",
+    "rate_limit",
+    type=float,
+    required=False,
+    help="Maximum Akamai API requests per second, shared by all concurrent requests",
+)
+@click.option(
+    "--profile",
+    "profile_format",
+    type=click.Choice(["table", "json", "chrome"]),
+    required=False,
+    help="Time each stage and PAPI request, reporting a summary table, JSON spans or a Chrome trace",
+)
+@click.option(
+    "--profile-output", "profile_output", required=False, help="File to write the profile to. Defaults to stderr"
+)
+@click.option("--cprofile", "cprofile_output", required=False, help="Write cProfile statistics to this file")
+@click.pass_context
+def cli(
+    ctx,
+    edgerc_path,
+    section,
+    account_key,
+    folder,
+    debug_mode,
+    pool_size,
+    cache_ttl,
+    connect_timeout,
+    read_timeout,
+    retries,
+    rate_limit,
+    profile_format,
+    profile_output,
+    cprofile_output,
+):
     ## Set up clients
-    global PROPERTY_CLIENT
+    global PROPERTY_CACHE_TTL
     global LOG_LEVEL
-    PROPERTY_CLIENT = Property(edgerc_path, section, account_key)
+    PROPERTY_CACHE_TTL = cache_ttl
+    PROPERTY_CLIENT_OPTIONS.update(
+        edgerc=edgerc_path,
+        section=section,
+        accountSwitchKey=account_key,
+        poolSize=pool_size,
+        connectTimeout=connect_timeout,
+        readTimeout=read_timeout,
+        maxRetries=retries,
+        rateLimit=rate_limit,
+    )
     LOG_LEVEL = "info"
     if debug_mode:
         LOG_LEVEL = "debug"
 
+    ## Debug mode logs each span as it completes
+    if profile_format is not None or debug_mode:
+        profiling.enable(log_spans=debug_mode)
+    if profile_format is not None:
+        ctx.call_on_close(lambda: profiling.write_report(profile_format, profile_output))
+    if cprofile_output is not None:
+        profiler = cProfile.Profile()
+        profiler.enable()
+
+        def write_cprofile():
+            profiler.disable()
+            profiler.dump_stats(cprofile_output)
+            click.echo(f"Wrote cProfile statistics to: {cprofile_output}", err=True)
+
+        ctx.call_on_close(write_cprofile)
+
 
 @cli.command("import")
 @click.option("--property", "-p", "import_property", required=True, help="Property Name to import")
@@ -182,8 +898,27 @@ def cli(edgerc_path, section, account_key, folder, debug_mode):
     default=False,
     help="By default, #include paths will be relative to the file which includes them. This option forces the path to be based on the default rule file instead.",
 )
+@click.option("--writers", "writers", type=int, default=16, help="Maximum number of template files written at once")
+@click.option(
+    "--differential",
+    "differential",
+    is_flag=True,
+    required=False,
+    default=False,
+    help="Only create, update or delete template files whose contents have changed, rather than rewriting every file",
+)
+@click.option(
+    "--dedupe",
+    "dedupe",
+    is_flag=True,
+    required=False,
+    default=False,
+    help="Store rules which appear more than once with identical contents a single time, in templates/_shared",
+)
 @click.pass_context
-def import_property(ctx, import_property, import_property_version, rule_format, use_full_paths):
+def import_property(
+    ctx, import_property, import_property_version, rule_format, use_full_paths, writers, differential, dedupe
+):
     """
     Retrieve rules from PAPI and break them down into templates
     """
@@ -199,114 +934,628 @@ def import_property(ctx, import_property, import_property_version, rule_format,
         import_property_version = property["propertyVersion"]
 
     ## Get rules from PAPI
-    rules = PROPERTY_CLIENT.getPropertyRules(property["propertyId"], import_property_version, rule_format)
+    rules = get_property_client().getPropertyRules(property["propertyId"], import_property_version, rule_format)
 
     ## Set destination folder
     dest_folder = ctx.parent.params["folder"] + "/templates"
 
-    ## Clear templates folder and recreate
-    if os.path.exists(dest_folder):
-        shutil.rmtree(dest_folder)
-    os.mkdir(dest_folder)
-
-    ## Split rules into templates folder
-    utilities.split_rules(rules, dest_folder, use_full_paths)
+    if differential and os.path.exists(dest_folder):
+        ## Compare the planned templates with those on disk and only touch what differs
+        with profiling.span("split templates"):
+            changes = utilities.sync_templates(
+                utilities.plan_split_rules(rules, use_full_paths, dedupe), dest_folder, writers
+            )
+        for change, colour in [("created", "green"), ("updated", "yellow"), ("deleted", "red")]:
+            for file_path in changes[change]:
+                click.secho(f"{change.capitalize()}: {file_path}", fg=colour)
+        click.echo(
+            f"{len(changes['created'])} created, {len(changes['updated'])} updated, "
+            f"{len(changes['deleted'])} deleted, {len(changes['unchanged'])} unchanged"
+        )
+        click.echo(f"Property '{import_property}' imported to {dest_folder}")
+        return
+
+    ## Split rules into a staging folder, then swap it into place so a failed import leaves templates untouched
+    staging_folder = dest_folder + ".importing"
+    if os.path.exists(staging_folder):
+        shutil.rmtree(staging_folder)
+    os.mkdir(staging_folder)
+    try:
+        with profiling.span("split templates"):
+            utilities.split_rules(rules, staging_folder, use_full_paths, writers, dedupe)
+    except:
+        shutil.rmtree(staging_folder)
+        raise
+    utilities.replace_folder(staging_folder, dest_folder)
 
     click.echo(f"Property '{import_property}' imported to {dest_folder}")
 
 
-@cli.command("update")
-@click.option("--environment", "environment_name", required=True, help="Environment to update")
-@click.option("--notes", "notes", required=False, help="Version notes to be added")
-@click.pass_context
-def update(ctx, environment_name, notes):
-    """
-    Merge templates and variables & push to PAPI
-    """
-    ## Get config
-    CONFIG = get_config(ctx.parent.params["folder"])
+def get_update_version(property):
+    ## Don't need to create new version so just go for it
+    if property["productionStatus"] == "INACTIVE" and property["stagingStatus"] == "INACTIVE":
+        return property["propertyVersion"]
+    click.secho(f"Creating new version of property {property['propertyName']}", fg="yellow")
+    new_version_result = get_property_client().newPropertyVersion(property["propertyId"], property["propertyVersion"])
+    version_matches = re.match(".*/versions/([\\d]+)", new_version_result)
+    return version_matches.group(1)
 
-    ## Get environment from config
-    environment = get_environment(environment_name, CONFIG)
 
-    ## Interpolate rules
-    rules = merge_pipeline(ctx.parent.params["folder"], environment_name)
+def update_environment(folder, CONFIG, environment, get_rules, notes, force=False):
+    ## get_rules blocks until the environment has been merged, so PAPI lookups made before calling it overlap the merge
+    environment_name = environment["name"]
 
     ## Get hostnames
-    hostnames = get_hostnames(ctx.parent.params["folder"], environment_name)
+    hostnames = get_hostnames(folder, environment_name)
 
     ## Get Property Status
     property = get_property(environment["propertyName"])
     property_name = property["propertyName"]
-    VERSIONLINK_MATCH = ".*/versions/([\\d]+)"
 
-    ## Don't need to create new version so just go for it
-    if property["productionStatus"] == "INACTIVE" and property["stagingStatus"] == "INACTIVE":
-        update_version = property["propertyVersion"]
-    else:
-        click.secho(f"Creating new version of property {property_name}", fg="yellow")
-        new_version_result = PROPERTY_CLIENT.newPropertyVersion(property["propertyId"], property["propertyVersion"])
-        version_matches = re.match(VERSIONLINK_MATCH, new_version_result)
-        update_version = version_matches.group(1)
-
-    ## Set Version Notes
-    now = datetime.now()
-    if notes is None:
-        time = now.strftime("%m/%d/%Y, %H:%M:%S")
-        rules["comments"] = f"Pypeline update: {time}"
-    else:
-        rules["comments"] = notes
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        ## Compare with the latest version, and skip the update entirely if neither rules nor hostnames have changed
+        update_needed = force
+        if not force:
+            current_rules = executor.submit(
+                get_property_client().getPropertyRules,
+                property["propertyId"],
+                property["propertyVersion"],
+                CONFIG["ruleFormat"],
+            )
+            current_hostnames = executor.submit(
+                get_property_client().listHostnames, property["propertyId"], property["propertyVersion"]
+            )
+            update_needed = utilities.hostnames_fingerprint(
+                current_hostnames.result()
+            ) != utilities.hostnames_fingerprint(hostnames)
+
+        ## Once an update is known to be needed the new version can be created while merging
+        update_version = None
+        if update_needed:
+            update_version = get_update_version(property)
+
+        rules = get_rules()
+        if not update_needed:
+            update_needed = utilities.rules_fingerprint(current_rules.result()["rules"]) != utilities.rules_fingerprint(
+                rules["rules"]
+            )
+            if not update_needed:
+                click.secho(
+                    f"Version {property['propertyVersion']} of property {property_name} is already up to date. Nothing to do",
+                    fg="green",
+                )
+                return
+            update_version = get_update_version(property)
+
+        ## Set Version Notes
+        now = datetime.now()
+        if notes is None:
+            time = now.strftime("%m/%d/%Y, %H:%M:%S")
+            rules["comments"] = f"Pypeline update: {time}"
+        else:
+            rules["comments"] = notes
 
-    ## Send updated config to PAPI
-    click.secho(
-        f"Pushing updates to version {update_version} of property {property_name}",
-        fg="yellow",
-    )
-    try:
-        rules_update_result = PROPERTY_CLIENT.updateVersion(
-            property["propertyId"], update_version, rules, CONFIG["ruleFormat"]
+        ## Send updated config to PAPI. Rules and hostnames are separate resources of the version, so are pushed together
+        click.secho(
+            f"Pushing updates and setting hostnames for version {update_version} of property {property_name}",
+            fg="yellow",
         )
-    except:
-        click.echo(f"Failed to update rules for property {property_name}. Bailing out...")
-        click.echo(str(hostnames_update_result))
-        sys.exit(1)
-
-    click.secho(
-        f"Setting hostnames for version {update_version} of property {property_name}",
-        fg="yellow",
-    )
-    try:
-        hostnames_update_result = PROPERTY_CLIENT.setHostnames(property["propertyId"], update_version, hostnames)
-    except:
-        click.echo(f"Failed to update hostnames for property {property_name}. Bailing out...")
-        click.echo(str(hostnames_update_result))
-        sys.exit(1)
+        rules_update = executor.submit(
+            get_property_client().updateVersion, property["propertyId"], update_version, rules, CONFIG["ruleFormat"]
+        )
+        hostnames_update = executor.submit(
+            get_property_client().setHostnames, property["propertyId"], update_version, hostnames
+        )
+        try:
+            rules_update_result = rules_update.result()
+        except Exception as err:
+            click.echo(f"Failed to update rules for property {property_name}. Bailing out...")
+            click.echo(str(err))
+            sys.exit(1)
+
+        try:
+            hostnames_update_result = hostnames_update.result()
+        except Exception as err:
+            click.echo(f"Failed to update hostnames for property {property_name}. Bailing out...")
+            click.echo(str(err))
+            sys.exit(1)
 
     click.secho("Environment {e} updated".format(e=environment_name), fg="green")
 
 
-@cli.command("merge")
-@click.option("--environment", "environment_name", required=True, help="Environment to update")
+@cli.command("update")
+@click.option(
+    "--environment",
+    "environment_name",
+    required=True,
+    help="Environment to update. Use 'all' or a comma-separated list to update several environments",
+)
+@click.option("--notes", "notes", required=False, help="Version notes to be added")
+@click.option(
+    "--processes", "processes", type=int, required=False, help="Worker processes for merging multiple environments"
+)
+@click.option(
+    "--concurrency", "concurrency", type=int, default=5, help="Maximum number of environments to push at once"
+)
+@click.option(
+    "--force",
+    "force",
+    is_flag=True,
+    default=False,
+    help="Push rules and hostnames even if they match the latest property version",
+)
 @click.pass_context
-def merge(ctx, environment_name):
+def update(ctx, environment_name, notes, processes, concurrency, force):
     """
-    Collate templates and apply variables, then output json file to dist folder
+    Merge templates and variables & push to PAPI
     """
+    folder = ctx.parent.params["folder"]
+
+    ## Get config
+    CONFIG = get_config(folder)
+
+    ## Get environments from config
+    environments = get_environments(environment_name, CONFIG)
+
+    ## Merge in the background while properties are looked up
+    if environment_name != "all" and "," not in environment_name:
+        with ThreadPoolExecutor(max_workers=1) as merge_executor:
+            rules = merge_executor.submit(merge_pipeline, folder, environments[0]["name"])
+            update_environment(folder, CONFIG, environments[0], rules.result, notes, force)
+        return
+
+    ## Interpolate rules for every environment, pushing each successful merge concurrently.
+    ## Update threads hold locks while workers start, so workers aren't forked from this process
+    with ThreadPoolExecutor(max_workers=1) as merge_executor:
+        merged = merge_executor.submit(
+            merge_pipelines, folder, [e["name"] for e in environments], processes, start_method="forkserver"
+        )
+
+        def get_rules(environment_name):
+            result = merged.result()[environment_name]
+            if isinstance(result, BaseException):
+                raise result
+            return result
+
+        results = {}
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            futures = {
+                e["name"]: executor.submit(
+                    update_environment, folder, CONFIG, e, functools.partial(get_rules, e["name"]), notes, force
+                )
+                for e in environments
+            }
+            for name, future in futures.items():
+                try:
+                    future.result()
+                    results[name] = None
+                except (Exception, SystemExit) as err:
+                    results[name] = err
+
+    if not report_results(results):
+        sys.exit(1)
 
-    ## Interpolate rules
-    rules = merge_pipeline(ctx.parent.params["folder"], environment_name)
 
+def write_dist(folder, environment_name, rules, indent=2):
     # Write rules to dist for now
-    dist_folder = ctx.parent.params["folder"] + "/dist"
+    dist_folder = folder + "/dist"
+    if not os.path.exists(dist_folder):
+        os.mkdir(dist_folder)
+    dist_file = dist_folder + "/" + environment_name + ".json"
+    with profiling.span("write dist", environment=environment_name), open(dist_file, "w") as f:
+        jsonbackend.dump(rules, f, indent=indent)
+    click.echo(f"Wrote updated rules to: {dist_file}")
+
+
+def stream_dist(folder, environment_name, indent=2):
+    ## Write rules to dist as each template is merged, via a temporary file so a failed merge leaves dist untouched
+    dist_folder = folder + "/dist"
     if not os.path.exists(dist_folder):
         os.mkdir(dist_folder)
     dist_file = dist_folder + "/" + environment_name + ".json"
-    with open(dist_file, "w") as f:
-        json.dump(rules, f, indent=2)
+    temp_file = dist_file + ".tmp"
+    try:
+        with profiling.span("stream merge", environment=environment_name), open(temp_file, "w") as f:
+            streamed = stream_pipeline(folder, environment_name, f, indent)
+    except BaseException:
+        os.remove(temp_file)
+        raise
+
+    if not streamed:
+        os.remove(temp_file)
+        click.echo(f"jsonPath variables for {environment_name} need the full rule tree. Merging in memory")
+        write_dist(folder, environment_name, merge_pipeline(folder, environment_name), indent)
+        return
+    os.replace(temp_file, dist_file)
     click.echo(f"Wrote updated rules to: {dist_file}")
+
+
+def scoped_out(comments, environment_name):
+    ## Whether comments certainly remove a rule from an environment. Comments with variables can't be known in advance
+    if not isinstance(comments, str) or "${env." in comments:
+        return False
+    return not rule_in_scope({"comments": comments}, environment_name)
+
+
+class PipelineServer:
+    ## Keeps a pipeline's merged templates in memory, re-merging only the environments affected by each change.
+    ## Changes are found by polling the modification time and size of every file the last merge read
+    def __init__(self, folder, environment_name, indent=2):
+        self.folder = folder
+        self.environment_name = environment_name
+        self.indent = indent
+        self.main_file = os.path.normpath(folder + "/templates/main.json")
+        self.lock = threading.Lock()
+        self.environment_names = []
+        self.templates = None
+        self.rule_scopes = None
+        self.template_files = set()
+        ## Reverse include graph: template -> templates including it, along with each template's includes and comments
+        self.template_parents = {}
+        self.template_children = {}
+        self.template_comments = {}
+        self.template_index = get_template_index(folder)["templates"]
+        ## Environments whose jsonPath variables could move rules in or out of scope
+        self.scope_changing = {}
+        self.snapshot = {}
+        self.results = {}
+
+    def get_config_files(self):
+        return {
+            os.path.normpath(self.folder + "/pipeline.json"),
+            os.path.normpath(self.folder + "/variableDefinitions.json"),
+        }
+
+    def get_variables_file(self, environment_name):
+        return os.path.normpath(self.folder + "/environments/" + environment_name + "/variables.json")
+
+    def get_watched_files(self):
+        files = self.get_config_files() | {self.get_variables_file(name) for name in self.environment_names}
+        if self.templates is not None:
+            return files | self.template_files
+        ## Until the templates merge, watch every file in case a missing include is added
+        for root, _, file_names in os.walk(self.folder + "/templates"):
+            files.update(os.path.normpath(os.path.join(root, file_name)) for file_name in file_names)
+        return files
+
+    def stat_files(self, files):
+        stats = {}
+        for file_path in files:
+            try:
+                file_stat = os.stat(file_path)
+                stats[file_path] = (file_stat.st_mtime_ns, file_stat.st_size)
+            except OSError:
+                stats[file_path] = None
+        return stats
+
+    def load_templates(self, changed_templates=None):
+        ## With changed_templates, only those templates and any new includes are indexed again
+        loaded_files = []
+        with profiling.span("merge templates"):
+            templates = utilities.merge_rules(self.main_file, loaded_files)
+        with profiling.span("compile scopes"):
+            rule_scopes = compile_rule_scopes(templates["rules"])
+
+        template_files = {os.path.normpath(f) for f in loaded_files}
+        if changed_templates is None:
+            self.template_parents = {}
+            self.template_children = {}
+            self.template_comments = {}
+            self.index_templates([self.main_file])
+        else:
+            ## Templates no longer included are left in the graph, but their parents no longer lead to them
+            self.index_templates([f for f in changed_templates if f in template_files and f in self.template_comments])
+
+        self.templates = templates
+        self.rule_scopes = rule_scopes
+        self.template_files = template_files
+
+    def index_templates(self, file_paths):
+        ## Record the comments and includes of each template in the reverse include graph, then of any includes not
+        ## yet recorded. Summaries come from the template index, so are read from the template cache
+        main_dir = os.path.dirname(self.main_file)
+        pending = list(file_paths)
+        while pending:
+            file_path = pending.pop()
+            summary = utilities.get_template_summary(file_path, main_dir, os.stat(file_path), self.template_index)
+            for child_path in self.template_children.get(file_path, []):
+                self.template_parents[child_path].discard(file_path)
+            children = []
+            for include in summary["includes"]:
+                include_filename = include.replace("#include:", "")
+                child_path, _ = utilities.find_template(
+                    os.path.dirname(file_path) + "/" + include_filename, main_dir + "/" + include_filename
+                )
+                child_path = os.path.normpath(child_path)
+                children.append(child_path)
+                self.template_parents.setdefault(child_path, set()).add(file_path)
+                if child_path not in self.template_comments:
+                    pending.append(child_path)
+            self.template_children[file_path] = children
+            self.template_comments[file_path] = summary["comments"]
+
+    def template_affects_environment(self, file_path, previous_comments, environment_name):
+        ## A changed template can only affect an environment if it was or is in scope, and so is every rule on some
+        ## chain of includes from main.json down to it
+        if self.scope_changing.get(environment_name, True):
+            return True
+        if scoped_out(previous_comments, environment_name) and scoped_out(
+            self.template_comments.get(file_path), environment_name
+        ):
+            return False
+        visited = set()
+        pending = list(self.template_parents.get(file_path, ()))
+        while pending:
+            parent = pending.pop()
+            if parent == self.main_file:
+                return True
+            if parent in visited or scoped_out(self.template_comments.get(parent), environment_name):
+                continue
+            visited.add(parent)
+            pending.extend(self.template_parents.get(parent, ()))
+        return False
+
+    def merge_environments(self, environment_names):
+        for name in environment_names:
+            try:
+                positional_variables, _ = get_variable_values(self.folder, name)
+                self.scope_changing[name] = any(changes_rule_scopes(path) for path, _ in positional_variables)
+                rules = merge_pipeline(self.folder, name, self.templates, self.rule_scopes)
+                write_dist(self.folder, name, rules, self.indent)
+                self.results[name] = rules
+            except (Exception, SystemExit) as err:
+                if not isinstance(err, SystemExit):
+                    click.secho(f"Failed to merge {name}: {err}", fg="red")
+                self.results[name] = err
+
+    def update(self, changed_files):
+        ## Work out which environments the changed files affect, and merge them again
+        if self.templates is None or changed_files & self.get_config_files():
+            CONFIG = get_config(self.folder)
+            self.environment_names = [e["name"] for e in get_environments(self.environment_name, CONFIG)]
+            self.results = {}
+            self.load_templates()
+            self.merge_environments(self.environment_names)
+            return self.environment_names
+
+        affected = {name for name in self.environment_names if self.get_variables_file(name) in changed_files}
+        changed_templates = changed_files & self.template_files
+        if changed_templates:
+            previous_comments = {f: self.template_comments.get(f) for f in changed_templates}
+            self.load_templates(changed_templates)
+            for file_path in changed_templates:
+                ## main.json and its variables apply to every environment, and the variables aren't in the include graph
+                if file_path == self.main_file or file_path not in self.template_comments:
+                    affected.update(self.environment_names)
+                else:
+                    affected.update(
+                        name
+                        for name in self.environment_names
+                        if self.template_affects_environment(file_path, previous_comments[file_path], name)
+                    )
+        environment_names = [name for name in self.environment_names if name in affected]
+        self.merge_environments(environment_names)
+        return environment_names
+
+    def refresh(self):
+        ## Merge again if any watched file has changed since the last refresh, returning the environments merged
+        with self.lock:
+            ## Without merged templates every template is watched, so look for files added since the last refresh
+            stats = self.stat_files(self.get_watched_files() if self.templates is None else self.snapshot)
+            changed_files = {f for f in stats.keys() | self.snapshot.keys() if stats.get(f) != self.snapshot.get(f)}
+            if len(changed_files) == 0:
+                return []
+
+            start = time.perf_counter()
+            try:
+                environment_names = self.update(changed_files)
+            except (Exception, SystemExit) as err:
+                if not isinstance(err, SystemExit):
+                    click.secho(f"Merge failed: {err}", fg="red")
+                ## Load everything again after the next change, and don't serve output which is now out of date
+                self.templates = None
+                self.results = {name: err for name in self.environment_names}
+                environment_names = []
+
+            ## Keep the stats from before merging, so changes made during the merge are picked up next time
+            watched = self.get_watched_files()
+            self.snapshot = self.stat_files(watched - stats.keys())
+            self.snapshot.update((f, file_stat) for f, file_stat in stats.items() if f in watched)
+
+            elapsed = (time.perf_counter() - start) * 1000
+            if len(environment_names) > 0:
+                click.secho(f"Merged {', '.join(environment_names)} in {elapsed:.0f} ms", fg="green")
+            elif self.templates is not None:
+                click.echo(f"No environments affected by changes to {', '.join(sorted(changed_files))}")
+            return environment_names
+
+    def get_output(self, environment_name):
+        ## Merged rules for an environment as JSON, after picking up any changes not yet merged
+        self.refresh()
+        with self.lock:
+            rules = self.results.get(environment_name)
+        if rules is None:
+            return jsonbackend.dumps({"error": f"Environment {environment_name} is not being served"})
+        if isinstance(rules, SystemExit):
+            return jsonbackend.dumps({"error": f"Failed to merge {environment_name}. See the serve output for details"})
+        if isinstance(rules, BaseException):
+            return jsonbackend.dumps({"error": f"Failed to merge {environment_name}: {rules}"})
+        return jsonbackend.dumps(rules, indent=self.indent)
+
+
+def start_socket_server(socket_path, pipeline_server):
+    ## Imported here so other commands don't pay for them at start up
+    import socket
+    import socketserver
+    import stat
+
+    class MergeRequestHandler(socketserver.StreamRequestHandler):
+        ## Answers a line naming an environment with its merged rules, or a JSON object with an error
+        def handle(self):
+            environment_name = self.rfile.readline().decode().strip()
+            self.wfile.write(pipeline_server.get_output(environment_name).encode() + b"\n")
+
+    if not hasattr(socketserver, "ThreadingUnixStreamServer"):
+        click.secho("--socket needs Unix domain sockets, which this platform does not support", fg="red")
+        sys.exit(1)
+    if os.path.exists(socket_path):
+        ## Only replace a socket left behind by a server which has stopped, never another kind of file
+        if not stat.S_ISSOCK(os.stat(socket_path).st_mode):
+            click.secho(f"{socket_path} already exists and is not a socket", fg="red")
+            sys.exit(1)
+        try:
+            with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as existing:
+                existing.connect(socket_path)
+            click.secho(f"Another server is already listening on {socket_path}", fg="red")
+            sys.exit(1)
+        except ConnectionRefusedError:
+            os.remove(socket_path)
+
+    socket_server = socketserver.ThreadingUnixStreamServer(socket_path, MergeRequestHandler)
+    socket_server.daemon_threads = True
+    threading.Thread(target=socket_server.serve_forever, daemon=True).start()
+    return socket_server
+
+
+@cli.command("merge")
+@click.option(
+    "--environment",
+    "environment_name",
+    required=True,
+    help="Environment to update. Use 'all' or a comma-separated list to merge several environments",
+)
+@click.option(
+    "--processes", "processes", type=int, required=False, help="Worker processes for merging multiple environments"
+)
+@click.option(
+    "--incremental",
+    "incremental",
+    is_flag=True,
+    default=False,
+    help="Skip environments whose templates, variables and dist output are unchanged since the last incremental merge",
+)
+@click.option(
+    "--stream",
+    "stream",
+    is_flag=True,
+    default=False,
+    help="Write each template to dist as it is merged rather than building the whole rule tree in memory",
+)
+@click.option("--compact", "compact", is_flag=True, default=False, help="Write dist files without indentation")
+@click.pass_context
+def merge(ctx, environment_name, processes, incremental, stream, compact):
+    """
+    Collate templates and apply variables, then output json file to dist folder
+    """
+    folder = ctx.parent.params["folder"]
+    multiple_environments = environment_name == "all" or "," in environment_name
+    indent = None if compact else 2
+
+    if stream and incremental:
+        click.secho("--stream cannot be combined with --incremental", fg="red")
+        sys.exit(1)
+
+    if multiple_environments:
+        CONFIG = get_config(folder)
+        environment_names = [e["name"] for e in get_environments(environment_name, CONFIG)]
+    else:
+        environment_names = [environment_name]
+
+    ## Only merge environments with changed inputs, reusing the last merged template tree where possible
+    templates = None
+    if incremental:
+        manifest = get_build_manifest(folder)
+        for name in [n for n in environment_names if build_up_to_date(folder, n, manifest, indent)]:
+            click.echo(f"Environment {name} is up to date")
+            environment_names.remove(name)
+        if len(environment_names) == 0:
+            click.secho("Merge complete", fg="green")
+            return
+        templates, template_fingerprints = load_build_templates(folder)
+
+    if stream:
+        ## Stream one environment at a time, keeping memory use to a single branch of the rule tree
+        results = {}
+        for name in environment_names:
+            try:
+                stream_dist(folder, name, indent)
+                results[name] = True
+            except (Exception, SystemExit) as err:
+                if not multiple_environments:
+                    raise
+                results[name] = err
+    elif not multiple_environments:
+        ## Interpolate rules
+        rules = merge_pipeline(folder, environment_name, templates)
+        write_dist(folder, environment_name, rules, indent)
+        results = {environment_name: rules}
+    else:
+        ## Interpolate rules for every environment from a single load of the templates
+        results = merge_pipelines(folder, environment_names, processes, templates)
+        for name, rules in results.items():
+            if not isinstance(rules, BaseException):
+                write_dist(folder, name, rules, indent)
+
+    if incremental:
+        for name, rules in results.items():
+            if not isinstance(rules, BaseException):
+                record_build(folder, name, manifest, template_fingerprints, indent)
+        save_build_manifest(folder, manifest)
+
+    if multiple_environments and not report_results(results):
+        sys.exit(1)
     click.secho("Merge complete", fg="green")
 
 
+@cli.command("serve")
+@click.option(
+    "--environment",
+    "environment_name",
+    required=False,
+    default="all",
+    help="Environment to merge. Use 'all' or a comma-separated list to merge several environments. Defaults to all",
+)
+@click.option("--interval", "interval", type=float, default=0.5, help="Seconds between checks for changed files")
+@click.option(
+    "--socket", "socket_path", required=False, help="Unix socket on which to answer requests for merged rules"
+)
+@click.option("--compact", "compact", is_flag=True, default=False, help="Write dist files without indentation")
+@click.pass_context
+def serve(ctx, environment_name, interval, socket_path, compact):
+    """
+    Keep dist up to date, merging environments again whenever their templates or variables change
+    """
+    folder = ctx.parent.params["folder"]
+
+    ## Check the environments exist before starting
+    CONFIG = get_config(folder)
+    get_environments(environment_name, CONFIG)
+
+    pipeline_server = PipelineServer(folder, environment_name, None if compact else 2)
+    pipeline_server.refresh()
+    socket_server = None
+    if socket_path is not None:
+        socket_server = start_socket_server(socket_path, pipeline_server)
+        click.echo(f"Answering requests for merged rules on {socket_path}")
+    click.echo(f"Watching {len(pipeline_server.snapshot)} files for changes. Press Ctrl+C to stop")
+
+    ## Stop cleanly when a service manager stops the server, as with Ctrl+C
+    import signal
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
+    try:
+        while True:
+            time.sleep(interval)
+            pipeline_server.refresh()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if socket_server is not None:
+            socket_server.shutdown()
+            socket_server.server_close()
+            os.remove(socket_path)
+
+
 @cli.command("activate")
 @click.option("--environment", "environment_name", required=True, help="Environment to activate")
 @click.option(
@@ -317,8 +1566,14 @@ def merge(ctx, environment_name):
     help="Network on which to activate. Staging or Production, defaults to Staging",
 )
 @click.option("--email", "email", required=True, help="Comma-separated email list for activation")
+@click.option("--wait", "wait", is_flag=True, default=False, help="Wait for the activation to complete")
+@click.option(
+    "--interval", "interval", type=float, default=5, help="Initial seconds between status checks when waiting"
+)
+@click.option("--max-interval", "max_interval", type=float, default=60, help="Maximum seconds between status checks")
+@click.option("--timeout", "timeout", type=float, required=False, help="Maximum seconds to wait for the activation")
 @click.pass_context
-def activate(ctx, environment_name, network, email):
+def activate(ctx, environment_name, network, email, wait, interval, max_interval, timeout):
     """
     Activate an environment on Staging or Production
     """
@@ -347,7 +1602,7 @@ def activate(ctx, environment_name, network, email):
         )
         sys.exit(1)
 
-    activations = PROPERTY_CLIENT.listActivations(property["propertyId"])
+    activations = get_property_client().listActivations(property["propertyId"])
     pending_activations = [a for a in activations if a["status"] == "PENDING"]
     if len(pending_activations) > 0:
         pending_version = pending_activations[0]["propertyVersion"]
@@ -359,13 +1614,74 @@ def activate(ctx, environment_name, network, email):
 
     ## Activate to chosen network
     try:
-        activate_result = PROPERTY_CLIENT.activate(property_id, property_version, network, email)
+        activate_result = get_property_client().activate(property_id, property_version, network, email)
     except:
         click.echo(
             f"Failed to activate version {property_version} of property {property_name} to {network}. Bailing out..."
         )
         sys.exit(1)
 
+    if wait:
+        activation = {
+            "environment": environment_name,
+            "propertyId": property_id,
+            "propertyName": property_name,
+            "propertyVersion": property_version,
+            "network": network.upper(),
+            "activationId": re.match(ACTIVATIONLINK_MATCH, activate_result["activationLink"]).group(1),
+            "status": "PENDING",
+        }
+        sys.exit(watch_activations([activation], interval, max_interval, timeout))
+
+
+@cli.command("watch")
+@click.option(
+    "--environment",
+    "environment_name",
+    required=False,
+    default="all",
+    help="Environment to watch. Use 'all' or a comma-separated list to watch several environments. Defaults to all",
+)
+@click.option("--network", "network", required=False, help="Only watch activations on Staging or Production")
+@click.option("--interval", "interval", type=float, default=5, help="Initial seconds between status checks")
+@click.option("--max-interval", "max_interval", type=float, default=60, help="Maximum seconds between status checks")
+@click.option("--timeout", "timeout", type=float, required=False, help="Maximum seconds to wait for activations")
+@click.option("--concurrency", "concurrency", type=int, default=10, help="Maximum number of status checks made at once")
+@click.pass_context
+def watch(ctx, environment_name, network, interval, max_interval, timeout, concurrency):
+    """
+    Wait for the latest activation of each environment to complete
+    """
+    ## Get config
+    CONFIG = get_config(ctx.parent.params["folder"])
+
+    ## Find the most recent activation of each environment's property
+    activations = []
+    for environment in get_environments(environment_name, CONFIG):
+        property = get_property(environment["propertyName"])
+        property_activations = get_property_client().listActivations(property["propertyId"])
+        if network is not None:
+            property_activations = [a for a in property_activations if a["network"] == network.upper()]
+        if len(property_activations) == 0:
+            click.echo(f"No activations found for environment {environment['name']}")
+            continue
+        latest_activation = sorted(property_activations, key=lambda a: a.get("submitDate", ""), reverse=True)[0]
+        activations.append(
+            {
+                "environment": environment["name"],
+                "propertyId": property["propertyId"],
+                "propertyName": latest_activation["propertyName"],
+                "propertyVersion": latest_activation["propertyVersion"],
+                "network": latest_activation["network"],
+                "activationId": latest_activation["activationId"],
+                "status": latest_activation["status"],
+            }
+        )
+
+    if len(activations) == 0:
+        sys.exit(1)
+    sys.exit(watch_activations(activations, interval, max_interval, timeout, concurrency))
+
 
 @cli.command("create")
 @click.option("--name", "name", required=True, help="Name for your new pipeline")
@@ -431,7 +1747,7 @@ def add_environment(ctx, name, property_name):
 
     ## Find property and get hostnames before doing anything else, in case it breaks
     property = get_property(property_name)
-    hostnames = PROPERTY_CLIENT.listHostnames(property["propertyId"], property["propertyVersion"])
+    hostnames = get_property_client().listHostnames(property["propertyId"], property["propertyVersion"])
 
     ## Update CONFIG
     environment = {"name": name, "propertyName": property_name}
@@ -519,36 +1835,149 @@ def add_variable(ctx, variable_name, variable_paths, variable_default):
     required=False,
     help="Specific environment to check. If omitted all environments will be displayed",
 )
+@click.option(
+    "--concurrency", "concurrency", type=int, default=10, help="Maximum number of environments to look up at once"
+)
+@click.option("--timeout", "timeout", type=float, required=False, help="Timeout in seconds for each PAPI request")
+@click.option("--json", "json_output", is_flag=True, default=False, help="Output status as JSON")
 @click.pass_context
-def status(ctx, environment_name):
+def status(ctx, environment_name, concurrency, timeout, json_output):
     """
     Show status of properties in each environment
     """
     ## Get config
     CONFIG = get_config(ctx.parent.params["folder"])
 
-    for environment in CONFIG["environments"]:
-        ## Skip other envs if environment specified
-        if environment_name is not None and environment["name"] != environment_name:
+    ## Skip other envs if environment specified
+    environments = [e for e in CONFIG["environments"] if environment_name is None or e["name"] == environment_name]
+
+    if timeout is not None:
+        get_property_client().timeout = timeout
+
+    environment_statuses = []
+    for environment_status in get_environment_statuses(environments, concurrency):
+        environment_statuses.append(environment_status)
+        if json_output:
             continue
 
-        property = get_property(environment["propertyName"])
         click.echo("-----------------------------------------")
         click.secho("Environment: ", nl=False, fg="blue")
-        click.echo(environment["name"])
+        click.echo(environment_status["environment"])
+        if "error" in environment_status.keys():
+            click.secho("Error: ", nl=False, fg="red")
+            click.echo(environment_status["error"])
+            continue
         click.secho("Property Name: ", nl=False, fg="blue")
-        click.echo(property["propertyName"])
+        click.echo(environment_status["propertyName"])
         click.secho("Property ID: ", nl=False, fg="blue")
-        click.echo(property["propertyId"])
+        click.echo(environment_status["propertyId"])
         click.secho("Property Version: ", nl=False, fg="blue")
-        click.echo(property["propertyVersion"])
-        if "note" in property.keys():
+        click.echo(environment_status["propertyVersion"])
+        if "note" in environment_status.keys():
             click.secho("Note: ", nl=False, fg="blue")
-            click.echo(property["note"])
+            click.echo(environment_status["note"])
+        click.secho("Staging Status: ", nl=False, fg="blue")
+        click.echo(environment_status["stagingStatus"])
+        click.secho("Production Status: ", nl=False, fg="blue")
+        click.echo(environment_status["productionStatus"])
+
+    if json_output:
+        click.echo(json.dumps(environment_statuses, indent=2))
+
+    if any("error" in e.keys() for e in environment_statuses):
+        sys.exit(1)
+
+
+@cli.command("search")
+@click.argument("match")
+@click.option(
+    "--qualifier",
+    "qualifiers",
+    multiple=True,
+    help="JSONPath which must also match a property's rules for it to be included. Can be repeated",
+)
+@click.option(
+    "--environment",
+    "environment_name",
+    default="all",
+    help="Environments to search. Use 'all' or a comma-separated list. Defaults to all",
+)
+@click.option(
+    "--account",
+    "search_account",
+    is_flag=True,
+    default=False,
+    help="Search every property in the account rather than the pipeline's environments",
+)
+@click.option(
+    "--max-age",
+    "max_age",
+    type=int,
+    default=3600,
+    help="Seconds to reuse cached results of the same search for. Set to 0 to always search",
+)
+@click.option("--json", "json_output", is_flag=True, default=False, help="Output results as JSON")
+@click.pass_context
+def search(ctx, match, qualifiers, environment_name, search_account, max_age, json_output):
+    """
+    Find rules matching a JSONPath across environments or the account
+    """
+    ## Map property names back to environments, unless searching the whole account
+    environment_names = {}
+    if not search_account:
+        CONFIG = get_config(ctx.parent.params["folder"])
+        for environment in get_environments(environment_name, CONFIG):
+            environment_names[environment["propertyName"]] = environment["name"]
+
+    ## The bulk search always covers the whole account, so one request serves every environment
+    search_body = {"bulkSearchQuery": {"syntax": "JSONPATH", "match": match}}
+    if qualifiers:
+        search_body["bulkSearchQuery"]["bulkSearchQualifiers"] = list(qualifiers)
+
+    cached_search = get_cached_search(search_body, max_age)
+    if cached_search is not None:
+        results = cached_search["results"]
+        age = int(time.time() - cached_search["cachedAt"])
+        click.secho(f"Using results cached {age} seconds ago. Add --max-age 0 to search again", fg="yellow", err=True)
+    else:
+        try:
+            results = get_property_client().bulkSearch(search_body)
+        except Exception as err:
+            click.secho(f"Search failed: {err}", fg="red")
+            sys.exit(1)
+        set_cached_search(search_body, results, max_age)
+
+    matches = []
+    for result in results:
+        if search_account:
+            matches.append(result)
+        elif result["propertyName"] in environment_names:
+            matches.append(dict(result, environment=environment_names[result["propertyName"]]))
+
+    if json_output:
+        click.echo(json.dumps(matches, indent=2))
+        return
+
+    if len(matches) == 0:
+        click.secho("No matching rules found", fg="yellow")
+        return
+
+    for result in matches:
+        click.echo("-----------------------------------------")
+        if "environment" in result:
+            click.secho("Environment: ", nl=False, fg="blue")
+            click.echo(result["environment"])
+        click.secho("Property Name: ", nl=False, fg="blue")
+        click.echo(result["propertyName"])
+        click.secho("Property Version: ", nl=False, fg="blue")
+        click.echo(f"{result['propertyVersion']}{' (latest)' if result.get('isLatest') else ''}")
         click.secho("Staging Status: ", nl=False, fg="blue")
-        click.echo(property["stagingStatus"])
+        click.echo(result.get("stagingStatus"))
         click.secho("Production Status: ", nl=False, fg="blue")
-        click.echo(property["productionStatus"])
+        click.echo(result.get("productionStatus"))
+        click.secho("Matches:", fg="blue")
+        for match_location in result.get("matchLocations", []):
+            click.echo("  " + match_location)
 
 
 @cli.command("set-ruleformat")
@@ -1,10 +1,29 @@
+import hashlib
+import itertools
 import json
 import os
+import re
+import stat
+import shutil
+import tempfile
+import threading
 import urllib.parse
-from jsonpath_ng.ext import parse
-from akamai.edgegrid import EdgeRc
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from ak import jsonbackend
 import click
 
+## Parsed templates keyed by path, each stored with the (mtime, size) it was read at
+TEMPLATE_CACHE = OrderedDict()
+TEMPLATE_CACHE_LOCK = threading.Lock()
+## Upper bound on the combined on-disk size of cached templates, after which least recently used entries are evicted
+TEMPLATE_CACHE_MAX_BYTES = 256 * 1024 * 1024
+TEMPLATE_CACHE_BYTES = 0
+
+## Deduplicated imports store rules which appear more than once here, relative to the templates folder
+SHARED_TEMPLATES_FOLDER = "_shared"
+
 
 def sanitizeFileName(unsafe_filename):
     safe_filename = unsafe_filename
@@ -19,15 +38,15 @@ def sanitizeFileName(unsafe_filename):
     return safe_filename
 
 
-def split_child_rule(rule, directory, use_full_paths, parent_path):
-    if not os.path.exists(directory):
-        # report("split_child_rule", "Making directory: " + directory, level="debug")
-        os.mkdir(directory)
-
+def plan_split_child_rule(rule, directory, use_full_paths, parent_path, files, shared=None):
     sanitized_rule_name = sanitizeFileName(rule["name"])
-    children_directory = directory + "/" + sanitized_rule_name
+    children_directory = os.path.join(directory, sanitized_rule_name)
 
     for index, child in enumerate(rule["children"]):
+        if shared is not None and shared["hashes"][id(child)] in shared["duplicates"]:
+            rule["children"][index] = "#include:" + plan_shared_rule(child, files, shared)
+            continue
+
         child_filename = sanitizeFileName(child["name"])
 
         # Handle use_full_paths option
@@ -37,42 +56,254 @@ def split_child_rule(rule, directory, use_full_paths, parent_path):
         else:
             child_path = sanitized_rule_name
 
-        split_child_rule(child, children_directory, use_full_paths, child_path)
+        plan_split_child_rule(child, children_directory, use_full_paths, child_path, files, shared)
 
         rule["children"][index] = f"#include:{child_path}/{child_filename}.json"
 
-    rule_filename = directory + "/" + sanitized_rule_name + ".json"
-    with open(rule_filename, "w") as rule_file:
-        json.dump(rule, rule_file, indent=2)
+    files[os.path.join(directory, sanitized_rule_name + ".json")] = rule
 
 
-def split_rules(rules, output_directory, use_full_paths):
-    ## Check Output Directory and create if required
-    if not os.path.exists(output_directory):
-        # report("split_rules", "Making directory: " + output_directory, level="debug")
-        os.mkdir(output_directory)
+def hash_rule(rule, hashes, counts):
+    ## Content hash of a rule and its children, recorded by object id along with how often each hash occurs.
+    ## Key order counts, so rules sharing a fragment merge to exactly what was imported
+    child_hashes = [hash_rule(child, hashes, counts) for child in rule.get("children", [])]
+    body = dict(rule, children=child_hashes) if "children" in rule else rule
+    digest = hashlib.sha256(jsonbackend.dumps(body).encode()).hexdigest()
+    hashes[id(rule)] = digest
+    counts[digest] = counts.get(digest, 0) + 1
+    return digest
+
+
+def plan_shared_rule(rule, files, shared):
+    ## Plan a rule which appears more than once as a single fragment in the shared folder, returning its path.
+    ## Its children are identical wherever it appears, so are shared too
+    digest = shared["hashes"][id(rule)]
+    file_path = shared["paths"].get(digest)
+    if file_path is not None:
+        return file_path
+    file_path = f"{SHARED_TEMPLATES_FOLDER}/{sanitizeFileName(rule['name'])}-{digest[:16]}.json"
+    if file_path in files:
+        raise (Exception(f"Shared template {file_path} would hold two different rules"))
+    shared["paths"][digest] = file_path
+
+    for index, child in enumerate(rule["children"]):
+        rule["children"][index] = "#include:" + plan_shared_rule(child, files, shared)
+    files[file_path] = rule
+    return file_path
+
+
+def plan_split_rules(rules, use_full_paths, dedupe=False):
+    ## Work out every template file and its contents up front, keyed by path relative to the templates folder.
+    ## With dedupe, rules appearing more than once with identical contents are only stored once
+    files = {}
+    shared = None
+    if dedupe:
+        shared = {"hashes": {}, "paths": {}}
+        counts = {}
+        for child in rules["rules"]["children"]:
+            hash_rule(child, shared["hashes"], counts)
+        shared["duplicates"] = {digest for digest, count in counts.items() if count > 1}
 
     ## Iterate through child rules
     for index, child in enumerate(rules["rules"]["children"]):
+        if shared is not None and shared["hashes"][id(child)] in shared["duplicates"]:
+            rules["rules"]["children"][index] = "#include:" + plan_shared_rule(child, files, shared)
+            continue
         child_filename = sanitizeFileName(child["name"]) + ".json"
-        split_child_rule(child, output_directory, use_full_paths, parent_path="")
+        plan_split_child_rule(child, "", use_full_paths, parent_path="", files=files, shared=shared)
         rules["rules"]["children"][index] = "#include:" + child_filename
 
     ## Create variables file
-    variables_filename = output_directory + "/pmVariables.json"
-    with open(variables_filename, "w") as variables_file:
-        json.dump(rules["rules"]["variables"], variables_file, indent=2)
+    files["pmVariables.json"] = rules["rules"]["variables"]
     rules["rules"]["variables"] = "#include:pmVariables.json"
 
-    main_filename = output_directory + "/main.json"
-    with open(main_filename, "w") as main_file:
-        json.dump(rules["rules"], main_file, indent=2)
+    files["main.json"] = rules["rules"]
+    return files
+
+
+def write_templates(files, output_directory, max_workers=None):
+    ## Create every directory in a single pass, then write the files concurrently
+    directories = sorted({os.path.dirname(os.path.join(output_directory, file_path)) for file_path in files})
+    for directory in directories:
+        # report("write_templates", "Making directory: " + directory, level="debug")
+        os.makedirs(directory, exist_ok=True)
+
+    def write_template(file_path):
+        with open(os.path.join(output_directory, file_path), "w") as template_file:
+            jsonbackend.dump(files[file_path], template_file, indent=2)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(write_template, files))
+
+
+def split_rules(rules, output_directory, use_full_paths, max_workers=None, dedupe=False):
+    files = plan_split_rules(rules, use_full_paths, dedupe)
+    write_templates(files, output_directory, max_workers)
+
 
+def is_case_insensitive(directory):
+    ## Checks whether a differently cased name finds the same file, as on default macOS and Windows volumes
+    with tempfile.NamedTemporaryFile(prefix="Case", dir=directory) as probe_file:
+        return os.path.exists(os.path.join(directory, os.path.basename(probe_file.name).lower()))
 
-def merge_child_rule(file_path, main_dir):
-    # report("merge_child_rule", "Loading file: " + file_path, level="debug")
-    with open(file_path, "r") as file:
-        rules = json.load(file)
+
+def sync_templates(files, output_directory, max_workers=None):
+    ## Only write template files whose contents differ from what is on disk, and remove files no longer produced
+    changes = {"created": [], "updated": [], "deleted": [], "unchanged": []}
+
+    existing_files = set()
+    for root, _, filenames in os.walk(output_directory):
+        for filename in filenames:
+            existing_files.add(os.path.relpath(os.path.join(root, filename), output_directory))
+
+    ## Paths are compared as the filesystem compares them, so a rule renamed only by case is the same file
+    if len(existing_files) > 0 and is_case_insensitive(output_directory):
+        path_key = lambda file_path: os.path.normcase(file_path).casefold()
+    else:
+        path_key = os.path.normcase
+    existing_paths = {path_key(file_path): file_path for file_path in existing_files}
+
+    contents = {}
+    renamed_files = []
+    for file_path, template in files.items():
+        contents[file_path] = jsonbackend.dumps(template, indent=2)
+        existing_path = existing_paths.pop(path_key(file_path), None)
+        if existing_path is None:
+            changes["created"].append(file_path)
+            continue
+        if os.path.normpath(existing_path) != os.path.normpath(file_path):
+            renamed_files.append(existing_path)
+            changes["updated"].append(file_path)
+            continue
+        with open(os.path.join(output_directory, file_path), "r") as template_file:
+            if template_file.read() == contents[file_path]:
+                changes["unchanged"].append(file_path)
+            else:
+                changes["updated"].append(file_path)
+
+    ## Files renamed only by case are removed before writing, so they take their new name
+    for file_path in renamed_files:
+        os.remove(os.path.join(output_directory, file_path))
+
+    ## Write each changed file to a temporary name first, so a failed import never leaves a partial file
+    def write_template(file_path):
+        template_path = os.path.join(output_directory, file_path)
+        os.makedirs(os.path.dirname(template_path), exist_ok=True)
+        with open(template_path + ".tmp", "w") as template_file:
+            template_file.write(contents[file_path])
+        os.replace(template_path + ".tmp", template_path)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        list(executor.map(write_template, changes["created"] + changes["updated"]))
+
+    ## Only files matching no planned path are left, so nothing just written is removed
+    for file_path in sorted(existing_paths.values()):
+        os.remove(os.path.join(output_directory, file_path))
+        changes["deleted"].append(file_path)
+
+    ## Remove any directories left empty by deleted templates
+    for root, _, _ in sorted(os.walk(output_directory), key=lambda w: len(w[0]), reverse=True):
+        if root != output_directory and len(os.listdir(root)) == 0:
+            os.rmdir(root)
+
+    return changes
+
+
+def replace_folder(staging_folder, folder):
+    ## Swap a fully written staging folder into place, only removing the previous folder once it has been replaced
+    previous_folder = folder + ".previous"
+    if os.path.exists(previous_folder):
+        shutil.rmtree(previous_folder)
+    if os.path.exists(folder):
+        os.rename(folder, previous_folder)
+    os.rename(staging_folder, folder)
+    if os.path.exists(previous_folder):
+        shutil.rmtree(previous_folder)
+
+
+def copy_json(value):
+    ## Copy a parsed JSON tree. Much cheaper than copy.deepcopy as only dicts and lists need copying
+    return jsonbackend.copy(value)
+
+
+def find_template(*file_paths):
+    ## Return the first of the candidate paths that is a file, along with its stat result
+    for file_path in file_paths:
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            continue
+        if stat.S_ISREG(file_stat.st_mode):
+            return file_path, file_stat
+    return None, None
+
+
+def clear_template_cache():
+    global TEMPLATE_CACHE_BYTES
+    with TEMPLATE_CACHE_LOCK:
+        TEMPLATE_CACHE.clear()
+        TEMPLATE_CACHE_BYTES = 0
+
+
+def load_template(file_path, file_stat=None, cache=True):
+    ## Without cache, the template isn't kept once read, for callers which must only hold part of the tree in memory
+    global TEMPLATE_CACHE_BYTES
+    file_path = os.path.normpath(file_path)
+    if file_stat is None:
+        file_stat = os.stat(file_path)
+    cache_key = (file_stat.st_mtime_ns, file_stat.st_size)
+
+    with TEMPLATE_CACHE_LOCK:
+        cached = TEMPLATE_CACHE.get(file_path)
+        if cached is not None and cached[0] == cache_key:
+            TEMPLATE_CACHE.move_to_end(file_path)
+            return copy_json(cached[1])
+
+    # report("load_template", "Loading file: " + file_path, level="debug")
+    template = jsonbackend.read(file_path)
+    if not cache:
+        return template
+
+    with TEMPLATE_CACHE_LOCK:
+        if file_path in TEMPLATE_CACHE:
+            TEMPLATE_CACHE_BYTES -= TEMPLATE_CACHE.pop(file_path)[0][1]
+        TEMPLATE_CACHE[file_path] = (cache_key, template)
+        TEMPLATE_CACHE_BYTES += file_stat.st_size
+        while TEMPLATE_CACHE_BYTES > TEMPLATE_CACHE_MAX_BYTES and len(TEMPLATE_CACHE) > 1:
+            evicted_key, _ = TEMPLATE_CACHE.popitem(last=False)[1]
+            TEMPLATE_CACHE_BYTES -= evicted_key[1]
+
+    # Callers modify the tree they are given, so never hand out the cached copy
+    return copy_json(template)
+
+
+def get_template_summary(file_path, main_dir, file_stat, template_index, cache=True):
+    ## Summarise a template's name, comments and includes, reusing its index entry while the file is unchanged
+    key = os.path.relpath(file_path, main_dir)
+    entry = template_index.get(key)
+    if entry is not None and entry["mtime"] == file_stat.st_mtime_ns and entry["size"] == file_stat.st_size:
+        return entry
+
+    rule = load_template(file_path, file_stat, cache)
+    entry = {
+        "mtime": file_stat.st_mtime_ns,
+        "size": file_stat.st_size,
+        "name": rule.get("name"),
+        "comments": rule.get("comments"),
+        "includes": [c for c in rule.get("children", []) if isinstance(c, str) and "#include:" in c],
+    }
+    template_index[key] = entry
+    return entry
+
+
+def merge_child_rule(
+    file_path, main_dir, file_stat=None, loaded_files=None, skip_include=None, rule_keys=(), fragments=None
+):
+    ## If supplied, skip_include(file_path, file_stat, rule_keys) may return a rule to use in place of loading an include.
+    ## If supplied, fragments maps each template already merged to its merged rule, for templates included again
+    rules = load_template(file_path, file_stat)
+    if loaded_files is not None:
+        loaded_files.append(file_path)
 
     # Infer parent dir
     parent_dir = os.path.dirname(file_path)
@@ -85,45 +316,161 @@ def merge_child_rule(file_path, main_dir):
             relative_include_path = parent_dir + "/" + include_filename
             main_include_path = main_dir + "/" + include_filename
 
-            if os.path.isfile(relative_include_path):
-                child_path = relative_include_path
-            elif os.path.isfile(main_include_path):
-                child_path = main_include_path
-            else:
+            child_path, child_stat = find_template(relative_include_path, main_include_path)
+            if child_path is None:
                 raise Exception(
                     f"File {include_filename} not found as either relative or full path from main. Please confirm file exists and try again."
                 )
 
-            child_rules = merge_child_rule(child_path, main_dir)
+            child_keys = rule_keys + ("children", index)
+            child_rules = skip_include(child_path, child_stat, child_keys) if skip_include is not None else None
+            if child_rules is None:
+                child_rules = merge_fragment(
+                    child_path, main_dir, child_stat, loaded_files, skip_include, child_keys, fragments
+                )
             rules["children"][index] = child_rules
 
     return rules
 
 
-def merge_rules(main_file_path):
+def merge_fragment(file_path, main_dir, file_stat, loaded_files, skip_include, rule_keys, fragments):
+    ## Templates included more than once, such as shared fragments, are only merged the first time
+    if fragments is None:
+        return merge_child_rule(file_path, main_dir, file_stat, loaded_files, skip_include, rule_keys)
+    if file_path in fragments:
+        return copy_json(fragments[file_path])
+    rules = merge_child_rule(file_path, main_dir, file_stat, loaded_files, skip_include, rule_keys, fragments)
+    ## Nothing changes merged rules until merge_rules returns, so later copies match this one
+    fragments[file_path] = rules
+    return rules
+
+
+def merge_rules(main_file_path, loaded_files=None, skip_include=None):
+    ## If supplied, loaded_files is extended with the path of every template file read.
+    ## Skipping an include depends on where it is, so merged fragments are only reused when nothing is skipped
+    fragments = {} if skip_include is None else None
     rules = {}
     # report("merge_rules", "Loading main file: " + main_file_path, level="debug")
-    with open(main_file_path, "r") as file:
-        rules["rules"] = json.load(file)
+    rules["rules"] = load_template(main_file_path)
+    if loaded_files is not None:
+        loaded_files.append(main_file_path)
     main_dir = os.path.dirname(main_file_path)
     child_file_prefix = main_dir + "/"
 
     for index, child in enumerate(rules["rules"]["children"]):
         if isinstance(child, str) and "#include:" in child:
             child_filename = child.replace("#include:", child_file_prefix)
-            child_rules = merge_child_rule(child_filename, main_dir)
+            child_keys = ("rules", "children", index)
+            child_rules = None
+            if skip_include is not None:
+                child_rules = skip_include(child_filename, os.stat(child_filename), child_keys)
+            if child_rules is None:
+                child_rules = merge_fragment(
+                    child_filename, main_dir, None, loaded_files, skip_include, child_keys, fragments
+                )
             rules["rules"]["children"][index] = child_rules
 
     if isinstance(rules["rules"]["variables"], str) and "#include:" in rules["rules"]["variables"]:
         variables_filename = rules["rules"]["variables"].replace("#include:", child_file_prefix)
         # report("merge_rules", "Loading variables file: " + variables_filename, level="debug")
-        with open(variables_filename, "r") as variables_file:
-            rules["rules"]["variables"] = json.load(variables_file)
+        rules["rules"]["variables"] = load_template(variables_filename)
+        if loaded_files is not None:
+            loaded_files.append(variables_filename)
 
     return rules
 
 
+def file_fingerprint(folder, file_path):
+    ## Record modification time, size and content hash of a file, keyed relative to the pipeline folder
+    file_stat = os.stat(file_path)
+    with open(file_path, "rb") as file:
+        digest = hashlib.sha256(file.read()).hexdigest()
+    return os.path.relpath(file_path, folder), {
+        "mtime": file_stat.st_mtime_ns,
+        "size": file_stat.st_size,
+        "sha256": digest,
+    }
+
+
+def fingerprints_unchanged(folder, fingerprints):
+    ## Compare recorded fingerprints with the files on disk. Content is only hashed when mtime or size differ
+    for relative_path, fingerprint in fingerprints.items():
+        file_path = os.path.join(folder, relative_path)
+        try:
+            file_stat = os.stat(file_path)
+        except OSError:
+            return False
+        if file_stat.st_mtime_ns == fingerprint["mtime"] and file_stat.st_size == fingerprint["size"]:
+            continue
+        if file_stat.st_size != fingerprint["size"]:
+            return False
+        with open(file_path, "rb") as file:
+            if hashlib.sha256(file.read()).hexdigest() != fingerprint["sha256"]:
+                return False
+    return True
+
+
+def rules_fingerprint(rules):
+    ## Hash of the rule tree in canonical form, so key order does not affect comparison
+    return hashlib.sha256(jsonbackend.dumps(rules, sort_keys=True).encode()).hexdigest()
+
+
+def hostnames_fingerprint(hostnames):
+    ## Only compare the fields which are set through PAPI, ignoring hostname order and certificate status
+    hostname_fields = ["cnameFrom", "cnameTo", "cnameType", "edgeHostnameId", "certProvisioningType"]
+    normalized_hostnames = sorted(
+        [{field: hostname.get(field) for field in hostname_fields} for hostname in hostnames],
+        key=lambda h: json.dumps(h, sort_keys=True),
+    )
+    return rules_fingerprint(normalized_hostnames)
+
+
+class LazyList:
+    ## A list whose items are only produced as it is written out by iter_json
+    def __init__(self, items):
+        self.items = items
+
+
+def iter_json(value, indent=2, level=0):
+    ## Encode JSON incrementally. With an indent the output matches json.dump, with None it is fully compact
+    if isinstance(value, dict):
+        if len(value) == 0:
+            yield "{}"
+            return
+        yield "{"
+        for index, (key, item) in enumerate(value.items()):
+            if index > 0:
+                yield ","
+            if indent is not None:
+                yield "\n" + " " * (indent * (level + 1))
+            yield json.dumps(str(key)) + (": " if indent is not None else ":")
+            yield from iter_json(item, indent, level + 1)
+        if indent is not None:
+            yield "\n" + " " * (indent * level)
+        yield "}"
+    elif isinstance(value, (list, LazyList)):
+        items = iter(value.items if isinstance(value, LazyList) else value)
+        first_item = next(items, LazyList)
+        if first_item is LazyList:
+            yield "[]"
+            return
+        yield "["
+        for index, item in enumerate(itertools.chain([first_item], items)):
+            if index > 0:
+                yield ","
+            if indent is not None:
+                yield "\n" + " " * (indent * (level + 1))
+            yield from iter_json(item, indent, level + 1)
+        if indent is not None:
+            yield "\n" + " " * (indent * level)
+        yield "]"
+    else:
+        yield json.dumps(value)
+
+
 def get_credentials(edgerc_path, section, account_key):
+    from akamai.edgegrid import EdgeRc
+
     credential_elements = ["host", "client_token", "access_token", "client_secret", "account_key"]
     credentials = {}
     edgerc = None
@@ -157,12 +504,192 @@ def get_credentials(edgerc_path, section, account_key):
     return credentials
 
 
+@lru_cache(maxsize=None)
+def compile_jsonpath(path):
+    ## Parsed expressions are cached for the lifetime of the process, so each path is only parsed once.
+    ## jsonpath_ng takes a while to import, so is only imported once a path needs parsing
+    from jsonpath_ng.ext import parse
+
+    return parse(path)
+
+
+@lru_cache(maxsize=None)
+def split_jsonpath(path):
+    ## Flatten a compiled path into its individual steps, e.g. $.rules.behaviors[0] -> $, rules, behaviors, [0]
+    from jsonpath_ng.jsonpath import Child
+
+    def flatten(expression):
+        if isinstance(expression, Child):
+            return flatten(expression.left) + flatten(expression.right)
+        return (expression,)
+
+    return flatten(compile_jsonpath(path))
+
+
+## Paths in this form are read without jsonpath_ng. where and wherenot are filter keywords rather than fields
+SIMPLE_JSONPATH_MATCH = re.compile(r"\$(?:\.(?!where(?:not)?(?=[.[]|$))[A-Za-z_]\w*(?=[.[]|$)|\[\d+\])+", re.ASCII)
+SIMPLE_JSONPATH_STEP = re.compile(r"\.(\w+)|\[(\d+)\]", re.ASCII)
+
+
+@lru_cache(maxsize=None)
+def get_simple_jsonpath_keys(path):
+    ## Convert paths made only of plain fields and non-negative indexes, e.g. $.rules.children[3].name, into a key tuple.
+    ## Returns None for anything else, such as wildcards, filters or slices
+    if SIMPLE_JSONPATH_MATCH.fullmatch(path):
+        return tuple(field if field else int(index) for field, index in SIMPLE_JSONPATH_STEP.findall(path, 1))
+
+    from jsonpath_ng.jsonpath import Fields, Index, Root
+
+    steps = split_jsonpath(path)
+    if not isinstance(steps[0], Root):
+        return None
+    keys = ()
+    for step in steps[1:]:
+        if isinstance(step, Fields) and len(step.fields) == 1 and step.fields[0] != "*":
+            keys += (step.fields[0],)
+        elif isinstance(step, Index):
+            ## Newer jsonpath_ng releases allow several indexes in one step
+            indices = step.indices if hasattr(step, "indices") else (step.index,)
+            if len(indices) != 1 or indices[0] < 0:
+                return None
+            keys += (indices[0],)
+        else:
+            return None
+    return keys if len(keys) > 0 else None
+
+
 def apply_variable_by_jsonpath(rules, path, value):
-    jsonpath_expression = parse(path)
-    rule_found = jsonpath_expression.find(rules)
+    return apply_variables_by_jsonpath(rules, [(path, value)])
 
-    if len(rule_found) > 0:
-        jsonpath_expression.update(rules, value)
-    else:
-        click.secho(f"WARNING: Path '{path}' not found in supplied rules. No update performed", fg="yellow")
+
+def find_simple_jsonpath(rules, keys):
+    ## Return the value holding the last key of a simple path, or None where jsonpath_ng wouldn't find the path
+    parent = rules
+    for depth, key in enumerate(keys):
+        if isinstance(key, int):
+            found = isinstance(parent, list) and key < len(parent)
+        else:
+            found = isinstance(parent, dict) and key in parent
+        if not found:
+            return None
+        if depth == len(keys) - 1:
+            return parent
+        parent = parent[key]
+
+
+@lru_cache(maxsize=None)
+def jsonpath_reads_values(path):
+    ## Whether the values a path matches can depend on values in the rules, as with filters, rather than only on
+    ## which fields and list items exist
+    from jsonpath_ng.jsonpath import Child, Descendants, Fields, Index, Root, Slice, This, Union
+
+    def reads_values(expression):
+        if type(expression) in (Child, Descendants, Union):
+            return reads_values(expression.left) or reads_values(expression.right)
+        return type(expression) not in (Fields, Index, Root, Slice, This)
+
+    return reads_values(compile_jsonpath(path))
+
+
+def find_jsonpaths(rules, paths):
+    ## Find every path which isn't simple with a single walk of a trie of path steps, so that paths sharing a prefix
+    ## share its traversal. Simple paths are left to the caller, and have no matches in the list returned
+    path_matches = [[] for _ in paths]
+    trie = {"children": {}, "paths": []}
+    for position, path in enumerate(paths):
+        if get_simple_jsonpath_keys(path) is not None:
+            continue
+        node = trie
+        for step in split_jsonpath(path):
+            node = node["children"].setdefault(repr(step), {"step": step, "children": {}, "paths": []})
+        node["paths"].append(position)
+
+    pending = []
+    if trie["children"]:
+        from jsonpath_ng.jsonpath import DatumInContext
+
+        pending.append((trie, [DatumInContext.wrap(rules)]))
+    while pending:
+        node, matches = pending.pop()
+        for position in node["paths"]:
+            path_matches[position] = matches
+        for child in node["children"].values():
+            child_matches = [submatch for match in matches for submatch in child["step"].find(match)]
+            if child_matches:
+                pending.append((child, child_matches))
+    return path_matches
+
+
+def apply_variables_by_jsonpath(rules, path_values):
+    ## Apply values in the order supplied, each to the rules as the values before it left them. Simple paths are
+    ## found directly as they are applied. The rest are found together, and found again when one is reached after
+    ## values which could change what it matches
+    paths = [path for path, value in path_values]
+    path_matches = find_jsonpaths(rules, paths)
+    changed = False
+    reshaped = False
+    for position, (path, value) in enumerate(path_values):
+        keys = get_simple_jsonpath_keys(path)
+        if keys is not None:
+            parent = find_simple_jsonpath(rules, keys)
+            matches = [] if parent is None else [(parent, keys[-1])]
+        else:
+            ## Replacing a dict or list changes which fields and items exist, and any change can alter a filter's matches
+            if reshaped or (changed and jsonpath_reads_values(path)):
+                path_matches[position:] = find_jsonpaths(rules, paths[position:])
+                changed = reshaped = False
+            matches = path_matches[position]
+        if len(matches) == 0:
+            click.secho(f"WARNING: Path '{path}' not found in supplied rules. No update performed", fg="yellow")
+            continue
+
+        for match in matches:
+            if isinstance(match, tuple):
+                parent, key = match
+                previous_value = parent[key]
+                parent[key] = value
+            elif match.context is not None:
+                previous_value = match.value
+                match.path.update(match.context.value, value)
+            else:
+                continue
+            changed = True
+            reshaped = reshaped or isinstance(previous_value, (dict, list)) or isinstance(value, (dict, list))
+    return rules
+
+
+VARIABLE_TOKEN = re.compile(r"\$\{env\.([^}]+)\}")
+
+
+def interpolate_string(value, variables):
+    if "${env." not in value:
+        return value
+
+    # Bools and ints only replace a token making up the whole string, so they keep their JSON type
+    whole_token = VARIABLE_TOKEN.fullmatch(value)
+    if whole_token is not None and whole_token.group(1) in variables:
+        variable_value = variables[whole_token.group(1)]
+        if isinstance(variable_value, (bool, int)):
+            return variable_value
+
+    # Strings are replaced wherever the token appears
+    def replace_token(match):
+        variable_value = variables.get(match.group(1))
+        if isinstance(variable_value, str):
+            return variable_value
+        return match.group(0)
+
+    return VARIABLE_TOKEN.sub(replace_token, value)
+
+
+def interpolate_variables(rules, variables):
+    ## Walk the rule tree once, replacing every ${env.<name>} token found in keys and values
+    if isinstance(rules, dict):
+        return {
+            interpolate_string(key, variables): interpolate_variables(value, variables) for key, value in rules.items()
+        }
+    elif isinstance(rules, list):
+        return [interpolate_variables(item, variables) for item in rules]
+    elif isinstance(rules, str):
+        return interpolate_string(rules, variables)
     return rules